@@ -0,0 +1,168 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+from benchmarking.synthetic_dataset import SCALES, generate_synthetic_dataset
+from working_with_tabular_data.tabular_operations import load_metadata, add_season_column_to_metadata, count_rows_per_season, count_rows_per_season_polars, count_rows_per_season_compact, get_label_statistics
+from working_with_remote_sensing_images.image_operations import checking_correctness, calculating_image_statistics, retiling_images
+from working_with_geospatial_vector_data.geo_parquet_operations import get_num_overlapping_patches
+from creating_splits_for_dl.create_splits import load_metadata as load_split_metadata, scan_metadata, split_train_test, split_train_test_polars, split_train_test_compact
+from working_with_tabular_data.compact_metadata import load_compact_metadata, add_season_column
+
+DATA_DIR = "./untracked-files/benchmark-data/"
+BASELINE_PATH = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "baseline.json")
+
+
+def bench_tabular_statistics(path: str):
+    metadata_path = path + "metadata.parquet"
+    count_rows_per_season(add_season_column_to_metadata(
+        load_metadata(metadata_path)))
+    label_counts = get_label_statistics(metadata_path)
+    label_counts.mean(), label_counts.max()
+
+
+def bench_tabular_statistics_polars(path: str):
+    metadata_path = path + "metadata.parquet"
+    count_rows_per_season_polars(metadata_path)
+    label_counts = get_label_statistics(metadata_path, backend="polars")
+    label_counts.mean(), label_counts.max()
+
+
+def bench_tabular_statistics_arrow(path: str):
+    metadata_path = path + "metadata.parquet"
+    count_rows_per_season_compact(add_season_column(
+        load_compact_metadata(metadata_path, columns=["patch_id"])))
+    label_counts = get_label_statistics(metadata_path, backend="arrow")
+    label_counts.mean(), label_counts.max()
+
+
+def bench_split_train_test(path: str):
+    split_train_test(load_split_metadata(path + "metadata.parquet"))
+
+
+def bench_split_train_test_polars(path: str):
+    split_train_test_polars(scan_metadata(path + "metadata.parquet"))
+
+
+def bench_split_train_test_arrow(path: str):
+    split_train_test_compact(load_compact_metadata(path + "metadata.parquet", columns=["patch_id"]))
+
+
+def bench_get_num_overlapping_patches(path: str):
+    get_num_overlapping_patches(path + "geoparquets")
+
+
+# Every task gets the archive root of one scale (with a trailing slash) and runs
+# with that root as working directory, so files it writes stay next to the data
+TASKS = {
+    "tabular_statistics": bench_tabular_statistics,
+    "tabular_statistics_polars": bench_tabular_statistics_polars,
+    "tabular_statistics_arrow": bench_tabular_statistics_arrow,
+    "checking_correctness": checking_correctness,
+    "calculating_image_statistics": calculating_image_statistics,
+    "retiling_images": retiling_images,
+    "get_num_overlapping_patches": bench_get_num_overlapping_patches,
+    "split_train_test": bench_split_train_test,
+    "split_train_test_polars": bench_split_train_test_polars,
+    "split_train_test_arrow": bench_split_train_test_arrow,
+}
+
+
+def prepare_dataset(data_dir: str, scale: str) -> str:
+    "Generate the archive of a scale unless it already exists and return its root path"
+    path = os.path.join(os.path.abspath(data_dir), scale) + "/"
+    if not os.path.exists(path + "expected.json"):
+        generate_synthetic_dataset(path, **SCALES[scale])
+    return path
+
+
+def time_task(task: str, path: str, repeats: int = 3) -> float:
+    "Return the best wall time in seconds out of repeats runs"
+    timings = []
+    with contextlib.chdir(path), contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeats):
+            start = time.perf_counter()
+            TASKS[task](path)
+            timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_benchmarks(scales, tasks, data_dir: str = DATA_DIR, repeats: int = 3) -> dict:
+    results = {}
+    for scale in scales:
+        path = prepare_dataset(data_dir, scale)
+        results[scale] = {}
+        for task in tasks:
+            results[scale][task] = time_task(task, path, repeats)
+            print(f"{scale:>8} {task:<30} {results[scale][task]:.3f}s")
+    return results
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float = 0.25) -> list:
+    """Return (scale, task, baseline_seconds, seconds) for every task slower than the baseline by more than tolerance.
+    Tasks without a baseline entry are returned as well, with None as baseline_seconds, so they are never left unchecked"""
+    regressions = []
+    for scale, timings in results.items():
+        for task, seconds in timings.items():
+            baseline_seconds = baseline.get(scale, {}).get(task)
+            if baseline_seconds is None or seconds > baseline_seconds * (1 + tolerance):
+                regressions.append((scale, task, baseline_seconds, seconds))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the milestone tasks on synthetic archives of several scales")
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES),
+                        default=["tiny", "small"])
+    parser.add_argument("--tasks", nargs="+",
+                        choices=list(TASKS), default=list(TASKS))
+    parser.add_argument("--data-dir", default=DATA_DIR,
+                        help="directory the synthetic archives are generated in")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--baseline", default=BASELINE_PATH,
+                        help="json file with the reference timings")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative slowdown before a task counts as regression")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="store the measured timings as the new baseline")
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        args.scales, args.tasks, args.data_dir, args.repeats)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+        for scale, timings in results.items():
+            baseline.setdefault(scale, {}).update(timings)
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(baseline, baseline_file, indent=2)
+        print(f"Updated baseline at {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --update-baseline to create one")
+        return
+
+    with open(args.baseline) as baseline_file:
+        regressions = compare_to_baseline(
+            results, json.load(baseline_file), args.tolerance)
+    for scale, task, baseline_seconds, seconds in regressions:
+        if baseline_seconds is None:
+            print(f"NO BASELINE {scale} {task}: {seconds:.3f}s, run with --update-baseline to record it")
+        else:
+            print(f"REGRESSION {scale} {task}: {baseline_seconds:.3f}s -> {seconds:.3f}s")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
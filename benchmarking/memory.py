@@ -0,0 +1,57 @@
+import argparse
+import tracemalloc
+
+import pyarrow as pa
+
+from creating_splits_for_dl.create_splits import parse_patch_ids_compact
+from working_with_tabular_data.compact_metadata import add_season_column, load_compact_metadata
+from working_with_tabular_data.tabular_operations import load_metadata, add_season_column_to_metadata
+
+
+def retained_bytes(load) -> tuple:
+    """Call load and return its result with the bytes it keeps alive: the Python objects and
+    numpy buffers traced by tracemalloc plus the buffers held by the Arrow memory pool.
+    Temporary allocations during loading are not counted."""
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    python_before, arrow_before = tracemalloc.get_traced_memory()[0], pa.total_allocated_bytes()
+    result = load()
+    retained = tracemalloc.get_traced_memory()[0] - python_before + pa.total_allocated_bytes() - arrow_before
+    if not tracing:
+        tracemalloc.stop()
+    return result, retained
+
+
+def load_pandas_metadata(metadata_path: str):
+    "All metadata columns with the derived season and tile_id columns as pandas object columns"
+    metadata = add_season_column_to_metadata(load_metadata(metadata_path))
+    metadata["tile_id"] = metadata["patch_id"].str.split("_").str[5]
+    return metadata
+
+
+def load_compact_metadata_with_derived(metadata_path: str):
+    "The same columns in compact form"
+    metadata = add_season_column(load_compact_metadata(metadata_path))
+    return metadata.append_column("tile_id", parse_patch_ids_compact(metadata["patch_id"])["tile_id"])
+
+
+def measure_metadata_memory(metadata_path: str) -> dict:
+    "Bytes kept alive by the pandas and by the compact metadata"
+    _, pandas_bytes = retained_bytes(lambda: load_pandas_metadata(metadata_path))
+    _, compact_bytes = retained_bytes(lambda: load_compact_metadata_with_derived(metadata_path))
+    return {"pandas": pandas_bytes, "compact": compact_bytes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the memory of the pandas and the compact metadata")
+    parser.add_argument("metadata_path")
+    args = parser.parse_args()
+
+    memory = measure_metadata_memory(args.metadata_path)
+    print(f"pandas: {memory['pandas'] / 2**20:.1f} MiB\ncompact: {memory['compact'] / 2**20:.1f} MiB\n"
+          f"reduction: {memory['pandas'] / memory['compact']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import argparse
+import gzip
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.transform import from_origin
+from shapely.geometry import box
+
+from working_with_geospatial_vector_data.geo_parquet_operations import CLASS_IDS
+from working_with_remote_sensing_images.image_operations import band_code_to_valid_size
+
+BAND_CODES = ["B01", "B02", "B03", "B04", "B05", "B06",
+              "B07", "B08", "B8A", "B09", "B11", "B12"]
+
+LABELS = ["Agro-forestry areas", "Arable land", "Beaches, dunes, sands", "Broad-leaved forest",
+          "Coastal wetlands", "Complex cultivation patterns", "Coniferous forest",
+          "Industrial or commercial units", "Inland waters", "Inland wetlands",
+          "Land principally occupied by agriculture, with significant areas of natural vegetation",
+          "Marine waters", "Mixed forest", "Moors, heathland and sclerophyllous vegetation",
+          "Natural grassland and sparsely vegetated areas", "Pastures", "Permanent crops",
+          "Transitional woodland, shrub", "Urban fabric"]
+
+# retiling_images works on this patch, so every generated archive contains it without errors
+RETILING_TILE = "S2B_MSIL2A_20170808T094029_N9999_R036_T35ULA"
+RETILING_H_V = (33, 29)
+
+PATCH_SIZE_METRES = 1200
+NO_DATA = 0
+
+# Number of tiles and patch grid side length per tile of the predefined scales. full is close
+# to the 549,488 patches of BigEarthNet and takes roughly 100 GB of disk; the grid keeps
+# RETILING_H_V inside the retiling tile up to a grid_size of 2 * min(RETILING_H_V) + 1
+SCALES = {
+    "tiny": {"num_tiles": 2, "grid_size": 4},
+    "small": {"num_tiles": 4, "grid_size": 10},
+    "medium": {"num_tiles": 10, "grid_size": 20},
+    "large": {"num_tiles": 25, "grid_size": 40},
+    "full": {"num_tiles": 158, "grid_size": 59},
+}
+
+
+def make_tile_names(num_tiles: int, rng: np.random.Generator) -> list:
+    tile_names = [RETILING_TILE]
+    while len(tile_names) < num_tiles:
+        month, day = rng.integers(1, 13), rng.integers(1, 29)
+        hour, minute = rng.integers(8, 13), rng.integers(0, 60)
+        utm_zone = rng.integers(29, 36)
+        latitude_band = rng.choice(list("UVW"))
+        square = "".join(rng.choice(list("ABCDEFGH"), size=2))
+        tile_names.append(
+            f"S2A_MSIL2A_2018{month:02d}{day:02d}T{hour:02d}{minute:02d}00_N9999_R{rng.integers(1, 144):03d}"
+            f"_T{utm_zone}{latitude_band}{square}")
+        tile_names = list(dict.fromkeys(tile_names))
+    return tile_names
+
+
+def tile_crs(tile_name: str) -> str:
+    "CRS of the UTM zone (northern hemisphere) in the tile id, e.g. T35ULA is EPSG:32635"
+    return f"EPSG:326{tile_name.rsplit('_', 1)[-1][1:3]}"
+
+
+def write_band(band_path: str, band_code: str, crs: str, origin_x: float, origin_y: float, rng: np.random.Generator,
+               wrong_size: bool = False, with_no_data: bool = False):
+    size = band_code_to_valid_size(band_code)
+    resolution = PATCH_SIZE_METRES / size
+    if wrong_size:
+        size += 1
+
+    data = rng.integers(1, 10000, size=(size, size), dtype=np.uint16)
+    if with_no_data:
+        data[:size // 4, :size // 4] = NO_DATA
+
+    with rasterio.open(
+        band_path, mode="w", driver="GTiff", width=size, height=size, count=1, dtype="uint16",
+        crs=crs, transform=from_origin(origin_x, origin_y, resolution, resolution), nodata=NO_DATA
+    ) as band_writer:
+        band_writer.write(data, 1)
+
+
+def write_patch_geoparquet(file_path: str, crs: str, origin_x: float, origin_y: float, rng: np.random.Generator,
+                           overlap_shift: float = 0.0):
+    """Cover the patch footprint with vertical strips, each labelled with one class id.
+
+    The strips are inset by one metre so neighbouring patches do not touch. A non-zero
+    overlap_shift moves all strips into the neighbouring patch to create an overlap.
+    """
+    num_polygons = int(rng.integers(1, 5))
+    edges = np.linspace(0, PATCH_SIZE_METRES, num_polygons + 1)
+    left = origin_x + overlap_shift
+    geometries = [box(left + x_min + 1, origin_y - PATCH_SIZE_METRES + 1, left + x_max - 1, origin_y - 1)
+                  for x_min, x_max in zip(edges[:-1], edges[1:])]
+    gdf = gpd.GeoDataFrame({"DN": rng.choice(CLASS_IDS, size=num_polygons).astype(np.int64)},
+                           geometry=geometries, crs=crs)
+    gdf.to_parquet(file_path)
+
+
+def generate_synthetic_dataset(output_path: str, num_tiles: int = 2, grid_size: int = 4, wrong_size_rate: float = 0.02,
+                               no_data_rate: float = 0.02, not_in_metadata_rate: float = 0.01,
+                               overlap_rate: float = 0.05, stats_rate: float = 0.1, seed: int = 0) -> dict:
+    """Write a BigEarthNet-like archive with the layout main.py expects below output_path.
+
+    Every tile holds a grid_size x grid_size grid of patches with twelve GeoTIFF bands
+    at their native sizes. The given fractions of patches get a wrong-sized band, no-data
+    pixels, no metadata row or an overlapping geoparquet. Returns the injected error
+    counts, which are also written to expected.json.
+    """
+    rng = np.random.default_rng(seed)
+    dataset_path = os.path.join(output_path, "BigEarthNet-v2.0-S2-with-errors")
+    geoparquet_path = os.path.join(output_path, "geoparquets")
+    os.makedirs(geoparquet_path, exist_ok=True)
+
+    expected = {"wrong-size": 0, "with-no-data": 0,
+                "not-part-of-dataset": 0, "num-patches": 0}
+    metadata_rows = []
+    stats_rows = []
+
+    for tile_index, tile_name in enumerate(make_tile_names(num_tiles, rng)):
+        # Tiles are placed far apart so that only injected overlaps exist, each in the CRS of its UTM zone
+        crs = tile_crs(tile_name)
+        tile_origin_x = 300000 + tile_index * (grid_size + 100) * PATCH_SIZE_METRES
+        tile_origin_y = 5800000
+        h_offset, v_offset = (RETILING_H_V[0] - grid_size // 2, RETILING_H_V[1] - grid_size // 2) \
+            if tile_name == RETILING_TILE else tuple(rng.integers(0, 60, size=2))
+
+        for h in range(h_offset, h_offset + grid_size):
+            for v in range(v_offset, v_offset + grid_size):
+                patch_id = f"{tile_name}_{h}_{v}"
+                patch_path = os.path.join(dataset_path, tile_name, patch_id)
+                os.makedirs(patch_path, exist_ok=True)
+                origin_x = tile_origin_x + h * PATCH_SIZE_METRES
+                origin_y = tile_origin_y - v * PATCH_SIZE_METRES
+
+                is_clean = tile_name == RETILING_TILE and (h, v) == RETILING_H_V
+                wrong_size = not is_clean and rng.random() < wrong_size_rate
+                with_no_data = not is_clean and rng.random() < no_data_rate
+                not_in_metadata = not is_clean and rng.random() < not_in_metadata_rate
+                wrong_size_band = rng.choice(BAND_CODES)
+
+                for band_code in BAND_CODES:
+                    write_band(os.path.join(patch_path, f"{patch_id}_{band_code}.tif"), band_code, crs, origin_x,
+                               origin_y, rng, wrong_size=wrong_size and band_code == wrong_size_band, with_no_data=with_no_data)
+
+                expected["wrong-size"] += int(wrong_size)
+                expected["with-no-data"] += int(with_no_data)
+                expected["not-part-of-dataset"] += int(not_in_metadata)
+                expected["num-patches"] += 1
+
+                if not not_in_metadata:
+                    num_labels = int(rng.integers(1, 6))
+                    metadata_rows.append({
+                        "patch_id": patch_id,
+                        "labels": rng.choice(LABELS, size=num_labels, replace=False).tolist(),
+                        "split": "train",
+                        "country": "Finland",
+                    })
+                    if rng.random() < stats_rate:
+                        stats_rows.append({"tile": tile_name, "patch_id": patch_id})
+
+                overlap_shift = PATCH_SIZE_METRES / 2 if rng.random() < overlap_rate else 0.0
+                write_patch_geoparquet(os.path.join(geoparquet_path, f"{patch_id}.parquet"),
+                                       crs, origin_x, origin_y, rng, overlap_shift)
+
+    pd.DataFrame(metadata_rows).to_parquet(
+        os.path.join(output_path, "metadata.parquet"))
+    with gzip.open(os.path.join(output_path, "patches_for_stats.csv.gz"), "wt") as stats_file:
+        pd.DataFrame(stats_rows, columns=["tile", "patch_id"]).to_csv(
+            stats_file, index=False)
+    with open(os.path.join(output_path, "expected.json"), "w") as expected_file:
+        json.dump(expected, expected_file, indent=2)
+
+    return expected
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic BigEarthNet-like archive")
+    parser.add_argument("output_path")
+    parser.add_argument("--scale", choices=list(SCALES), default="tiny")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    expected = generate_synthetic_dataset(
+        args.output_path, seed=args.seed, **SCALES[args.scale])
+    print(json.dumps(expected, indent=2))
+
+
+if __name__ == "__main__":
+    main()
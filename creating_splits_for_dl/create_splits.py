@@ -2,15 +2,34 @@ import os
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
+import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from instrumentation.tracing import instrumented, record_file_read, record_parquet_rows
+from working_with_tabular_data.compact_metadata import SPLITS, encode_codes, encode_strings, label_ids_and_offsets, load_compact_metadata
+
+SPLIT_MODES = ("central", "stratified")
+BACKENDS = ("pandas", "polars", "arrow")
 
 
 def load_metadata(path: str) -> pd.DataFrame:
     full_path = os.path.abspath(path)
     assert os.path.exists(full_path), f"File does not exist: {full_path}"
+    record_file_read(full_path)
     metadata = pd.read_parquet(full_path)
+    record_parquet_rows(len(metadata))
     return metadata
 
 
+def scan_metadata(path: str) -> pl.LazyFrame:
+    full_path = os.path.abspath(path)
+    assert os.path.exists(full_path), f"File does not exist: {full_path}"
+    record_file_read(full_path)
+    return pl.scan_parquet(full_path)
+
+
 def get_tile_id(patch_id: str) -> str:
     parts = patch_id.split("_")
     assert len(parts) == 8, f"Invalid patch_id format: {patch_id}"
@@ -67,41 +86,384 @@ def plot_distribution_of_time(metadata: pd.DataFrame):
     plt.tight_layout()
 
 
-def split_train_test(metadata: pd.DataFrame, test_ratio: float = 0.2) -> pd.DataFrame:
-    metadata = create_tile_id_column(metadata)
-    metadata = metadata.copy()
-    metadata['H'] = metadata['patch_id'].apply(extract_h_order)
-    metadata['V'] = metadata['patch_id'].apply(extract_v_order)
-    metadata['split'] = 'train'
+def _first_invalid(ids: pa.Array, invalid) -> str:
+    return ids.filter(invalid)[0].as_py()
+
+
+def _parse_patch_id_fields(ids: pa.Array) -> tuple:
+    """Split patch_ids into their tile_id, H order and V order string arrays.
+
+    Parses with pyarrow compute kernels, which avoids creating a Python list per
+    patch_id, and asserts the format with the messages of get_tile_id/extract_h_order/extract_v_order.
+    """
+    invalid = pc.not_equal(pc.count_substring(ids, "_"), 7)
+    assert not pc.any(invalid).as_py(), \
+        f"Invalid patch_id format: {_first_invalid(ids, invalid)}"
+
+    # Only the last three fields are needed: <Txxxxxx>_<H-Order>_<V-Order>
+    parts = pc.split_pattern(ids, "_", max_splits=3, reverse=True)
+    tile_ids = pc.list_element(parts, 1)
+    h_orders = pc.list_element(parts, 2)
+    v_orders = pc.list_element(parts, 3)
+
+    invalid = pc.invert(pc.starts_with(tile_ids, "T"))
+    assert not pc.any(invalid).as_py(), \
+        f"Tile ID does not start with 'T': {_first_invalid(ids, invalid)}"
+    invalid = pc.invert(pc.utf8_is_digit(h_orders))
+    assert not pc.any(invalid).as_py(), \
+        f"H order is not a digit: {_first_invalid(ids, invalid)}"
+    invalid = pc.invert(pc.utf8_is_digit(v_orders))
+    assert not pc.any(invalid).as_py(), \
+        f"V order is not a digit: {_first_invalid(ids, invalid)}"
+
+    return tile_ids, h_orders, v_orders
+
+
+def parse_patch_ids(patch_ids: pd.Series) -> pd.DataFrame:
+    """Vectorized counterpart of get_tile_id/extract_h_order/extract_v_order.
+
+    Returns a frame aligned with patch_ids holding tile_id, H and V.
+    """
+    tile_ids, h_orders, v_orders = _parse_patch_id_fields(pa.array(patch_ids, type=pa.string()))
+
+    return pd.DataFrame({
+        'tile_id': tile_ids.to_numpy(zero_copy_only=False),
+        'H': pc.cast(h_orders, pa.int64()).to_numpy(),
+        'V': pc.cast(v_orders, pa.int64()).to_numpy(),
+    }, index=patch_ids.index)
+
 
+def parse_patch_ids_compact(patch_ids) -> pa.Table:
+    """parse_patch_ids for compact metadata: tile_id is dictionary encoded with sorted
+    tile codes, H and V are int16, no Python string is created."""
+    if isinstance(patch_ids, pa.ChunkedArray):
+        patch_ids = patch_ids.combine_chunks()
+    tile_ids, h_orders, v_orders = _parse_patch_id_fields(patch_ids.cast(pa.string()))
+
+    return pa.table({
+        'tile_id': encode_strings(tile_ids),
+        'H': pc.cast(h_orders, pa.int16()),
+        'V': pc.cast(v_orders, pa.int16()),
+    })
+
+
+def compute_tile_extents(metadata: pd.DataFrame) -> pd.DataFrame:
+    """Return the min/max H and V order of every tile_id in one grouped aggregation."""
+    return metadata.groupby('tile_id', sort=True, observed=True).agg(
+        min_H=('H', 'min'), max_H=('H', 'max'),
+        min_V=('V', 'min'), max_V=('V', 'max'))
+
+
+def compute_tile_windows(metadata: pd.DataFrame, test_ratio: float = 0.2) -> pd.DataFrame:
+    """Compute the central test window of every tile from its H/V extents.
+
+    Expects the tile_id, H and V columns and returns one row per tile_id with
+    the half-open window bounds [central_min_H, central_max_H) x [central_min_V, central_max_V).
+    """
     central_width_factor = np.sqrt(test_ratio)
 
-    grouped = metadata.groupby('tile_id')
+    extents = compute_tile_extents(metadata)
+
+    range_H = extents['max_H'] - extents['min_H'] + 1
+    range_V = extents['max_V'] - extents['min_V'] + 1
+
+    central_width_H = np.maximum(
+        (central_width_factor * range_H).astype(np.int64), 1)
+    central_width_V = np.maximum(
+        (central_width_factor * range_V).astype(np.int64), 1)
+
+    windows = pd.DataFrame(index=extents.index)
+    windows['central_min_H'] = extents['min_H'] + \
+        (range_H - central_width_H) // 2
+    windows['central_max_H'] = windows['central_min_H'] + central_width_H
+    windows['central_min_V'] = extents['min_V'] + \
+        (range_V - central_width_V) // 2
+    windows['central_max_V'] = windows['central_min_V'] + central_width_V
+    return windows
+
+
+def assign_splits(metadata: pd.DataFrame, windows: pd.DataFrame) -> np.ndarray:
+    """Join every patch to its tile window and return a boolean test mask."""
+    # Vectorized join: look up the window of every row's tile in one go
+    tile_windows = windows.reindex(metadata['tile_id'].to_numpy())
+    H = metadata['H'].to_numpy()
+    V = metadata['V'].to_numpy()
+    return (
+        (H >= tile_windows['central_min_H'].to_numpy()) &
+        (H < tile_windows['central_max_H'].to_numpy()) &
+        (V >= tile_windows['central_min_V'].to_numpy()) &
+        (V < tile_windows['central_max_V'].to_numpy())
+    )
+
+
+def compute_block_label_counts(metadata: pd.DataFrame, block_ids: np.ndarray, num_blocks: int):
+    """Count label occurrences per spatial block.
+
+    The (block, label) pairs are the sparse coordinates of the count matrix; they
+    are accumulated with a single bincount into a dense num_blocks x num_labels
+    array, which stays small because there are only a few dozen labels.
+    Returns (label_counts, label_names).
+    """
+    labels = metadata['labels'].reset_index(drop=True).explode().dropna()
+    label_codes, label_names = pd.factorize(labels, sort=True)
+    num_labels = len(label_names)
+
+    flat_index = block_ids[labels.index.to_numpy()] * num_labels + label_codes
+    label_counts = np.bincount(flat_index, minlength=num_blocks * num_labels)
+    return label_counts.reshape(num_blocks, num_labels), label_names
+
+
+def _choose_split(desired_label: np.ndarray, desired_size: np.ndarray, rng: np.random.Generator) -> int:
+    # Prefer the split that still needs most of the label, then the one that needs most patches
+    candidates = np.flatnonzero(desired_label == desired_label.max())
+    if len(candidates) > 1:
+        sizes = desired_size[candidates]
+        candidates = candidates[sizes == sizes.max()]
+    if len(candidates) > 1:
+        return int(rng.choice(candidates))
+    return int(candidates[0])
+
+
+def iterative_stratification(label_counts: np.ndarray, block_sizes: np.ndarray, ratios, seed: int = 0) -> np.ndarray:
+    """Assign blocks to splits with iterative stratification (Sechidis et al., 2011).
+
+    Works on whole blocks instead of single samples: the rarest remaining label is
+    distributed first and every block carrying it goes to the split whose demand
+    for that label is largest. Returns the split index of every block.
+    """
+    rng = np.random.default_rng(seed)
+    ratios = np.asarray(ratios, dtype=np.float64)
+    num_blocks = label_counts.shape[0]
+
+    assignment = np.full(num_blocks, -1, dtype=np.int64)
+    desired_labels = np.outer(ratios, label_counts.sum(axis=0))
+    desired_sizes = ratios * block_sizes.sum()
+    remaining = label_counts.sum(axis=0)
+
+    # Fixed random visiting order so ties do not depend on block numbering
+    order = rng.permutation(num_blocks)
+    ordered_counts = label_counts[order]
+
+    while remaining.any():
+        label = np.flatnonzero(remaining)[np.argmin(remaining[remaining > 0])]
+        blocks = order[(ordered_counts[:, label] > 0) & (assignment[order] < 0)]
+
+        for block in blocks:
+            split = _choose_split(
+                desired_labels[:, label], desired_sizes, rng)
+            assignment[block] = split
+            desired_labels[split] -= label_counts[block]
+            desired_sizes[split] -= block_sizes[block]
+            remaining -= label_counts[block]
+
+    # Blocks without any labels only have to balance the split sizes
+    for block in order[assignment[order] < 0]:
+        split = _choose_split(desired_sizes, desired_sizes, rng)
+        assignment[block] = split
+        desired_sizes[split] -= block_sizes[block]
+
+    return assignment
+
+
+def compute_block_label_counts_compact(labels, block_ids: np.ndarray, num_blocks: int) -> np.ndarray:
+    """compute_block_label_counts on compact labels, the label ids already are the label codes"""
+    label_ids, offsets, label_names = label_ids_and_offsets(labels)
+    num_labels = len(label_names)
+
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    flat_index = block_ids[rows] * num_labels + label_ids
+    label_counts = np.bincount(flat_index, minlength=num_blocks * num_labels)
+    return label_counts.reshape(num_blocks, num_labels)
+
+
+def _stratified_test_mask(orders: pd.DataFrame, count_block_labels, test_ratio: float, block_size: int,
+                          seed: int) -> np.ndarray:
+    # orders holds tile_id, H and V, count_block_labels(block_ids, num_blocks) the block x label counts
+    block_ids = orders.groupby(
+        [orders['tile_id'], orders['H'] // block_size, orders['V'] // block_size], sort=True).ngroup().to_numpy()
+    num_blocks = int(block_ids.max()) + 1 if len(block_ids) else 0
+
+    label_counts = count_block_labels(block_ids, num_blocks)
+    block_sizes = np.bincount(block_ids, minlength=num_blocks)
+
+    # Split index 0 is train and 1 is test
+    assignment = iterative_stratification(
+        label_counts, block_sizes, [1 - test_ratio, test_ratio], seed)
+    return assignment[block_ids] == 1
+
+
+def stratified_split_train_test(metadata: pd.DataFrame, test_ratio: float = 0.2, block_size: int = 4,
+                                seed: int = 0) -> pd.DataFrame:
+    """Label-balanced split that keeps block_size x block_size patch blocks of a tile together."""
+    parsed = parse_patch_ids(metadata['patch_id'])
+    metadata = metadata.assign(
+        tile_id=parsed['tile_id'], H=parsed['H'], V=parsed['V'])
+
+    is_test = _stratified_test_mask(
+        metadata, lambda block_ids, num_blocks: compute_block_label_counts(metadata, block_ids, num_blocks)[0],
+        test_ratio, block_size, seed)
+
+    metadata['split'] = 'train'
+    metadata.loc[is_test, 'split'] = 'test'
+
+    return metadata
+
+
+@instrumented()
+def split_train_test(metadata: pd.DataFrame, test_ratio: float = 0.2, mode: str = "central", **kwargs) -> pd.DataFrame:
+    """Split into train/test.
+
+    mode="central" puts the central window of each tile into test, mode="stratified"
+    uses stratified_split_train_test (extra keyword arguments are passed on).
+    """
+    assert mode in SPLIT_MODES, f"Unknown split mode: {mode}, expected one of {SPLIT_MODES}"
+    if mode == "stratified":
+        return stratified_split_train_test(metadata, test_ratio, **kwargs)
+
+    parsed = parse_patch_ids(metadata['patch_id'])
+    metadata = metadata.assign(
+        tile_id=parsed['tile_id'], H=parsed['H'], V=parsed['V'])
+
+    windows = compute_tile_windows(metadata, test_ratio)
+    is_test = assign_splits(metadata, windows)
+    metadata['split'] = 'train'
+    metadata.loc[is_test, 'split'] = 'test'
+
+    return metadata
+
+
+def _assign_spatial_folds(metadata: pd.DataFrame, k: int):
+    assert 1 < k <= np.iinfo(np.int8).max, f"k must be between 2 and 127: {k}"
+    parsed = parse_patch_ids(metadata['patch_id'])
+    metadata = metadata.assign(
+        tile_id=parsed['tile_id'], H=parsed['H'], V=parsed['V'])
 
-    for tile_id, group in grouped:
-        min_H, max_H = group['H'].min(), group['H'].max()
-        min_V, max_V = group['V'].min(), group['V'].max()
+    tile_extents = compute_tile_extents(
+        metadata).reindex(metadata['tile_id'].to_numpy())
+    min_H = tile_extents['min_H'].to_numpy()
+    range_H = tile_extents['max_H'].to_numpy() - min_H + 1
+    min_V = tile_extents['min_V'].to_numpy()
+    range_V = tile_extents['max_V'].to_numpy() - min_V + 1
 
-        range_H = max_H - min_H + 1
-        range_V = max_V - min_V + 1
+    # Stripes run across the longer axis of every tile, so a tall tile is not cut into slivers
+    along_V = range_V > range_H
+    order = np.where(along_V, metadata['V'].to_numpy(), metadata['H'].to_numpy())
+    min_order = np.where(along_V, min_V, min_H)
+    order_range = np.where(along_V, range_V, range_H)
 
-        central_width_H = max(int(central_width_factor * range_H), 1)
-        central_width_V = max(int(central_width_factor * range_V), 1)
+    metadata['fold'] = ((order - min_order) * k // order_range).astype(np.int8)
+    return metadata, order, min_order, order_range
 
-        central_min_H = min_H + (range_H - central_width_H) // 2
-        central_max_H = central_min_H + central_width_H
 
-        central_min_V = min_V + (range_V - central_width_V) // 2
-        central_max_V = central_min_V + central_width_V
+def assign_spatial_folds(metadata: pd.DataFrame, k: int = 5) -> pd.DataFrame:
+    """Assign every patch to one of k spatially contiguous folds.
+
+    Each tile is cut into k stripes of (almost) equal width along its longer
+    axis, H on ties; the stripe index is stored as a compact int8 fold column.
+    """
+    metadata, _, _, _ = _assign_spatial_folds(metadata, k)
+    return metadata
 
-        condition = (
-            (metadata['tile_id'] == tile_id) &
-            (metadata['H'] >= central_min_H) & (metadata['H'] < central_max_H) &
-            (metadata['V'] >= central_min_V) & (metadata['V'] < central_max_V)
-        )
 
-        metadata.loc[condition, 'split'] = 'test'
+def spatial_k_fold(metadata: pd.DataFrame, k: int = 5, buffer: int = 0):
+    """Spatial k-fold cross-validation over the H/V grid of every tile.
+
+    Parses and groups the metadata once and then yields (train_index, test_index)
+    positional index arrays for each of the k folds. Training patches closer than
+    buffer cells to the test stripe of their tile, counted along the axis the tile
+    is cut along, are left out of both sets.
+    """
+    assert buffer >= 0, f"buffer must not be negative: {buffer}"
+    metadata, order, min_order, order_range = _assign_spatial_folds(metadata, k)
+    folds = metadata['fold'].to_numpy()
+
+    for fold in range(k):
+        is_test = folds == fold
+        is_train = ~is_test
+        if buffer:
+            # Stripe bounds [start, end) inverted from fold = (order - min_order) * k // order_range
+            start = min_order - (-fold * order_range // k)
+            end = min_order - (-(fold + 1) * order_range // k)
+            is_train &= (order < start - buffer) | (order >= end + buffer)
+        yield np.flatnonzero(is_train), np.flatnonzero(is_test)
+
+
+@instrumented()
+def split_train_test_polars(metadata, test_ratio: float = 0.2) -> pl.DataFrame:
+    """Polars counterpart of split_train_test(mode="central").
+
+    Takes a LazyFrame (e.g. from scan_metadata, so only the selected columns are read)
+    or a DataFrame. Tile extents are window expressions over tile_id, so rows keep
+    their order without a join and everything runs in one multithreaded query.
+    """
+    parts = pl.col("patch_id").str.split("_")
+    H, V = pl.col("H"), pl.col("V")
+    central_width_factor = float(np.sqrt(test_ratio))
+
+    def central_window(order):
+        min_order = order.min().over("tile_id")
+        order_range = order.max().over("tile_id") - min_order + 1
+        central_width = (central_width_factor * order_range).cast(pl.Int64).clip(lower_bound=1)
+        central_min = min_order + (order_range - central_width) // 2
+        return (order >= central_min) & (order < central_min + central_width)
+
+    metadata = metadata.lazy().with_columns(
+        _valid_format=parts.list.len() == 8,
+        tile_id=parts.list.get(5, null_on_oob=True),
+        H=parts.list.get(6, null_on_oob=True),
+        V=parts.list.get(7, null_on_oob=True),
+    ).with_columns(
+        _valid_tile_id=pl.col("tile_id").str.starts_with("T"),
+        _valid_H=H.str.contains(r"^\d+$"),
+        _valid_V=V.str.contains(r"^\d+$"),
+        H=H.cast(pl.Int64, strict=False),
+        V=V.cast(pl.Int64, strict=False),
+    ).with_columns(
+        split=pl.when(central_window(H) & central_window(V)).then(
+            pl.lit("test")).otherwise(pl.lit("train")),
+    ).collect()
+    record_parquet_rows(len(metadata))
+
+    for column, message in [("_valid_format", "Invalid patch_id format"),
+                            ("_valid_tile_id", "Tile ID does not start with 'T'"),
+                            ("_valid_H", "H order is not a digit"),
+                            ("_valid_V", "V order is not a digit")]:
+        invalid = metadata.filter(~metadata[column].fill_null(False))
+        assert invalid.is_empty(), f"{message}: {invalid['patch_id'][0]}"
+
+    return metadata.drop("_valid_format", "_valid_tile_id", "_valid_H", "_valid_V")
+
+
+@instrumented()
+def split_train_test_compact(metadata: pa.Table, test_ratio: float = 0.2, mode: str = "central",
+                             block_size: int = 4, seed: int = 0) -> pa.Table:
+    """split_train_test on compact metadata from load_compact_metadata, with the same assignment.
+
+    Works on the integer tile codes, H/V orders and label ids instead of strings. Adds
+    tile_id, H and V and sets split as int8 codes into SPLITS.
+    """
+    assert mode in SPLIT_MODES, f"Unknown split mode: {mode}, expected one of {SPLIT_MODES}"
+    parsed = parse_patch_ids_compact(metadata['patch_id'])
+    # The tile codes are sorted like the tile_id strings, so they group in the same order
+    orders = pd.DataFrame({
+        'tile_id': parsed['tile_id'].combine_chunks().indices.to_numpy(),
+        'H': parsed['H'].to_numpy().astype(np.int64),
+        'V': parsed['V'].to_numpy().astype(np.int64),
+    })
 
+    if mode == "stratified":
+        is_test = _stratified_test_mask(
+            orders, lambda block_ids, num_blocks: compute_block_label_counts_compact(metadata['labels'], block_ids, num_blocks),
+            test_ratio, block_size, seed)
+    else:
+        is_test = assign_splits(orders, compute_tile_windows(orders, test_ratio))
+
+    split = encode_codes(np.where(is_test, SPLITS.index('test'), SPLITS.index('train')), SPLITS)
+    for name, column in [('tile_id', parsed['tile_id']), ('H', parsed['H']), ('V', parsed['V']), ('split', split)]:
+        if name in metadata.column_names:
+            metadata = metadata.set_column(metadata.column_names.index(name), name, column)
+        else:
+            metadata = metadata.append_column(name, column)
     return metadata
 
 
@@ -166,12 +528,33 @@ def plot_label_distribution(metadata: pd.DataFrame):
     plt.tight_layout()
 
 
-def save_splits_to_csv(metadata_path: str, output_path: str = "./untracked-files/split.csv"):
-    # Load the metadata
+def compute_splits(metadata_path: str, mode: str = "central", backend: str = "pandas") -> pd.DataFrame:
+    "Load the metadata and split it with the chosen backend"
+    assert backend in BACKENDS, f"Unknown backend: {backend}, expected one of {BACKENDS}"
+    if backend == "polars":
+        assert mode == "central", "The polars backend only implements the central split mode"
+        # Only patch_id is needed, the other columns are never read from the parquet file
+        return split_train_test_polars(scan_metadata(metadata_path).select("patch_id")).to_pandas()
+    if backend == "arrow":
+        # tile_id and split stay categorical in the returned frame
+        columns = ["patch_id", "labels"] if mode == "stratified" else ["patch_id"]
+        metadata = split_train_test_compact(load_compact_metadata(metadata_path, columns), mode=mode)
+        return metadata.select(["patch_id", "tile_id", "H", "V", "split"]).to_pandas()
+
     metadata = load_metadata(metadata_path)
+    return split_train_test(metadata, mode=mode)
+
 
-    # Create train/test split
-    metadata = split_train_test(metadata)
+@instrumented()
+def save_splits_to_csv(metadata_path: str, output_path: str = "./untracked-files/split.csv", mode: str = "central",
+                       windows_path: str = None, backend: str = "pandas"):
+    # Load the metadata and create train/test split
+    metadata = compute_splits(metadata_path, mode, backend)
+
+    # Persist the tile windows so that new patches can be assigned later on
+    if windows_path is not None:
+        assert mode == "central", "Tile windows only exist for the central split mode"
+        save_tile_windows(compute_tile_windows(metadata), windows_path)
 
     # Create output directory if it doesn't exist
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
@@ -192,6 +575,154 @@ def save_splits_to_csv(metadata_path: str, output_path: str = "./untracked-files
     print(f"Created csv file with train/test split at {output_path}")
 
 
+def build_split_table(metadata: pd.DataFrame) -> pa.Table:
+    """Long-format (patch_id, split, fold) table of a split metadata frame.
+
+    Rows are sorted by split so that every split is one contiguous slice, and the
+    split column is dictionary encoded. fold is null when no fold column exists.
+    """
+    num_rows = len(metadata)
+    table = pa.table({
+        'patch_id': pa.array(metadata['patch_id'], type=pa.string()),
+        'split': pa.array(metadata['split'], type=pa.string()),
+        'fold': pa.array(metadata['fold'], type=pa.int8()) if 'fold' in metadata else pa.nulls(num_rows, pa.int8()),
+    })
+    table = table.sort_by([('split', 'ascending'), ('fold', 'ascending')])
+    split = pc.dictionary_encode(table['split'].combine_chunks())
+    return table.set_column(1, 'split', split.cast(pa.dictionary(pa.int8(), pa.string())))
+
+
+@instrumented()
+def save_splits_to_parquet(metadata_path: str, output_path: str = "./untracked-files/split.parquet",
+                           mode: str = "central", k: int = None, windows_path: str = None, backend: str = "pandas"):
+    metadata = compute_splits(metadata_path, mode, backend)
+    if k is not None:
+        metadata['fold'] = assign_spatial_folds(metadata[['patch_id']], k)['fold']
+    if windows_path is not None:
+        assert mode == "central", "Tile windows only exist for the central split mode"
+        save_tile_windows(compute_tile_windows(metadata), windows_path)
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    pq.write_table(build_split_table(metadata), output_path)
+    print(f"Created parquet file with train/test split at {output_path}")
+
+
+class SplitLookup:
+    """Read-only view of a split table written by save_splits_to_parquet.
+
+    Patch lookups go through a hash index over patch_id and per-split patch_id
+    arrays are zero-copy slices of the loaded table.
+    """
+
+    def __init__(self, table: pa.Table):
+        self.table = table.combine_chunks()
+        split = self.table['split']
+        split = split.chunk(0) if split.num_chunks else pa.array(
+            [], pa.dictionary(pa.int8(), pa.string()))
+        self.split_names = split.dictionary.to_pylist()
+        self._codes = split.indices.to_numpy(zero_copy_only=False)
+        assert (np.diff(self._codes) >= 0).all(), "Split table is not sorted by split"
+        self._folds = self.table['fold']
+        self._index = pd.Index(self.table['patch_id'].to_pandas())
+        assert self._index.is_unique, "Split table contains duplicate patch_ids"
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def __contains__(self, patch_id: str) -> bool:
+        return patch_id in self._index
+
+    def split_of(self, patch_id: str) -> str:
+        return self.split_names[self._codes[self._index.get_loc(patch_id)]]
+
+    def fold_of(self, patch_id: str):
+        return self._folds[self._index.get_loc(patch_id)].as_py()
+
+    def splits_of(self, patch_ids) -> pd.Categorical:
+        positions = self._index.get_indexer(patch_ids)
+        assert (positions >= 0).all(), "Unknown patch_id in lookup"
+        return pd.Categorical.from_codes(self._codes[positions], self.split_names)
+
+    def patch_ids(self, split: str) -> pa.Array:
+        assert split in self.split_names, f"Unknown split: {split}"
+        code = self.split_names.index(split)
+        start = np.searchsorted(self._codes, code, side='left')
+        end = np.searchsorted(self._codes, code, side='right')
+        return self.table['patch_id'].chunk(0).slice(start, end - start)
+
+
+def load_splits(path: str) -> SplitLookup:
+    full_path = os.path.abspath(path)
+    assert os.path.exists(full_path), f"File does not exist: {full_path}"
+    record_file_read(full_path)
+    table = pq.read_table(full_path)
+    record_parquet_rows(table.num_rows)
+    return SplitLookup(table)
+
+
+def save_tile_windows(windows: pd.DataFrame, path: str, test_ratio: float = 0.2):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    windows = windows.rename_axis('tile_id').reset_index()
+    # Windows of compact metadata are indexed by a categorical, the file always holds plain strings
+    windows['tile_id'] = windows['tile_id'].astype(str)
+    windows['test_ratio'] = test_ratio
+    windows.to_parquet(path, index=False)
+
+
+def load_tile_windows(path: str) -> pd.DataFrame:
+    full_path = os.path.abspath(path)
+    assert os.path.exists(full_path), f"File does not exist: {full_path}"
+    return pd.read_parquet(full_path).set_index('tile_id')
+
+
+class StreamingSplitAssigner:
+    """Assign train/test to batches of new patch_ids against persisted tile windows.
+
+    Windows of known tiles are never recomputed, so patches that were already
+    assigned keep their split no matter which patches arrive later. A tile seen
+    for the first time gets its window from the extents of the batch that
+    introduces it, and that window is fixed from then on. As a batch with a few
+    patches of a tile would fix a window of a few cells, a new tile is only
+    fixed once its batch spans at least min_extent cells along H and V. Until
+    then its patches are returned unassigned (None) and should be resubmitted
+    together with more patches of their tile.
+    """
+
+    def __init__(self, windows: pd.DataFrame, test_ratio: float = 0.2, min_extent: int = 5):
+        assert min_extent >= 1, f"min_extent must be positive: {min_extent}"
+        self.windows = windows[['central_min_H', 'central_max_H',
+                                'central_min_V', 'central_max_V']]
+        self.test_ratio = test_ratio
+        self.min_extent = min_extent
+
+    @classmethod
+    def from_file(cls, path: str, min_extent: int = 5) -> "StreamingSplitAssigner":
+        windows = load_tile_windows(path)
+        test_ratio = windows['test_ratio'].iloc[0] if len(windows) else 0.2
+        return cls(windows, test_ratio, min_extent)
+
+    def save(self, path: str):
+        save_tile_windows(self.windows, path, self.test_ratio)
+
+    def assign(self, patch_ids) -> pd.Series:
+        patch_ids = pd.Series(patch_ids)
+        parsed = parse_patch_ids(patch_ids)
+
+        is_new_tile = ~parsed['tile_id'].isin(self.windows.index)
+        if is_new_tile.any():
+            extents = compute_tile_extents(parsed[is_new_tile])
+            is_wide_enough = ((extents['max_H'] - extents['min_H'] + 1 >= self.min_extent) &
+                              (extents['max_V'] - extents['min_V'] + 1 >= self.min_extent))
+            new_windows = compute_tile_windows(
+                parsed[is_new_tile], self.test_ratio)
+            self.windows = pd.concat([self.windows, new_windows[is_wide_enough]])
+
+        is_known = parsed['tile_id'].isin(self.windows.index).to_numpy()
+        is_test = assign_splits(parsed, self.windows)
+        split = np.where(is_known, np.where(is_test, 'test', 'train'), None)
+        return pd.Series(split, index=patch_ids.to_numpy(), name='split')
+
+
 # Uncomment to plot the distribution of time, label distribution and split distribution
 
 # def main():
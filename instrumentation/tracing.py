@@ -0,0 +1,168 @@
+import contextlib
+import functools
+import json
+import os
+import sys
+import time
+
+# Set to a file path to append one json line per finished stage, or to "-" for stderr
+TRACE_ENV_VAR = "APP4RS_TRACE"
+
+# Fields of a stage record:
+#   stage, pid, start                 name, process id and unix start time
+#   files_opened                      files passed to record_file_read, a file read twice counts twice
+#   bytes_read                        approximation: the size of every opened file, so a parquet scan
+#                                     that projects a few columns (polars/arrow backends) is overstated
+#   parquet_rows_scanned              rows passed to record_parquet_rows
+#   duckdb_query_seconds              time spent inside duckdb_query()
+#   wall_seconds, cpu_seconds         of the stage
+#   rss_start_mb, rss_end_mb          resident set size of the process when the stage started and ended,
+#                                     null where /proc is not available
+#   peak_rss_mb                       peak resident set size while the stage ran, including its inner
+#                                     stages. The peak of the process is reset at every stage start through
+#                                     /proc/self/clear_refs, so it is null where that is not available
+
+_trace_target = os.environ.get(TRACE_ENV_VAR) or None
+# Records of the stages that are currently running, innermost last
+_active_stages = []
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+def configure(trace_target: str = None):
+    "Switch tracing on (target path or '-') or off (None), also for child processes started afterwards"
+    global _trace_target
+    _trace_target = trace_target or None
+    if _trace_target is None:
+        os.environ.pop(TRACE_ENV_VAR, None)
+    else:
+        os.environ[TRACE_ENV_VAR] = _trace_target
+
+
+def is_enabled() -> bool:
+    return _trace_target is not None
+
+
+def _add(counter: str, value):
+    # Counters are added to every running stage, so outer stages include their inner ones
+    for record in _active_stages:
+        record[counter] += value
+
+
+def record_file_read(path: str):
+    "Count a file that is opened for reading; its size stands in for the bytes read from it"
+    if _active_stages:
+        _add("files_opened", 1)
+        _add("bytes_read", os.path.getsize(path))
+
+
+def record_parquet_rows(num_rows: int):
+    if _active_stages:
+        _add("parquet_rows_scanned", int(num_rows))
+
+
+@contextlib.contextmanager
+def _time_duckdb_query():
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add("duckdb_query_seconds", time.perf_counter() - start)
+
+
+def duckdb_query():
+    "Context manager that adds the time spent inside it to the DuckDB query time"
+    return _time_duckdb_query() if _active_stages else _NULL_CONTEXT
+
+
+def _current_rss_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return None
+
+
+def _reset_peak_rss() -> bool:
+    "Reset the peak resident set size (VmHWM) of the process to its current size, only possible on Linux"
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _update_peak_rss():
+    # The peak since the last reset counts towards every running stage, before it is reset again
+    peak_rss_mb = _peak_rss_mb()
+    for record in _active_stages:
+        if record["peak_rss_mb"] is not None and peak_rss_mb is not None:
+            record["peak_rss_mb"] = max(record["peak_rss_mb"], peak_rss_mb)
+
+
+def _write_record(record: dict):
+    line = json.dumps(record)
+    if _trace_target == "-":
+        print(line, file=sys.stderr)
+    else:
+        with open(_trace_target, "a") as trace_file:
+            trace_file.write(line + "\n")
+
+
+@contextlib.contextmanager
+def _traced_stage(name: str):
+    record = {
+        "stage": name,
+        "pid": os.getpid(),
+        "start": time.time(),
+        "files_opened": 0,
+        "bytes_read": 0,
+        "parquet_rows_scanned": 0,
+        "duckdb_query_seconds": 0.0,
+        "rss_start_mb": _current_rss_mb(),
+    }
+    _update_peak_rss()
+    record["peak_rss_mb"] = _peak_rss_mb() if _reset_peak_rss() else None
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    _active_stages.append(record)
+    try:
+        yield record
+    finally:
+        _update_peak_rss()
+        _active_stages.remove(record)
+        record["wall_seconds"] = time.perf_counter() - wall_start
+        record["cpu_seconds"] = time.process_time() - cpu_start
+        record["rss_end_mb"] = _current_rss_mb()
+        _write_record(record)
+
+
+def stage(name: str):
+    "Context manager that traces everything inside it as one stage when tracing is enabled"
+    return _traced_stage(name) if _trace_target is not None else _NULL_CONTEXT
+
+
+def instrumented(name: str = None):
+    "Decorator that traces every call of the function as a stage, named after the function by default"
+    def decorator(function):
+        stage_name = name or f"{function.__module__}.{function.__name__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _trace_target is None:
+                return function(*args, **kwargs)
+            with _traced_stage(stage_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,31 +1,251 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import functools
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
 from working_with_tabular_data.tabular_operations import print_counts_per_season, print_avg_num_labels, print_max_num_labels
 from working_with_remote_sensing_images.image_operations import checking_correctness, calculating_image_statistics, retiling_images
 from working_with_geospatial_vector_data.geo_parquet_operations import print_avg_num_labels as print_avg_num_labels_geo, print_num_overlapping_patches
 from creating_splits_for_dl.create_splits import save_splits_to_csv
+from instrumentation.tracing import TRACE_ENV_VAR, configure as configure_tracing, stage as traced_stage
 
+REPO_PATH = os.path.dirname(os.path.abspath(__file__))
+# Directories of the repository that hold no code the stages run
+NON_SOURCE_DIRS = {"tests", "untracked-files", "__pycache__"}
+CACHE_DIR = "./untracked-files/.cache/"
 
-def main():
+
+def run_tabular_task(path: str, backend: str = "pandas"):
     # Task 3: Working with tabular data
-    path = "./untracked-files/milestone01/metadata.parquet"
-    print_counts_per_season(path)
-    print_avg_num_labels(path)
-    print_max_num_labels(path)
-
-    # Task 4: 
-    path = "./untracked-files/milestone01/"
-    checking_correctness(path)
-    calculating_image_statistics(path)
+    print_counts_per_season(path, backend=backend)
+    print_avg_num_labels(path, backend=backend)
+    print_max_num_labels(path, backend=backend)
+
+
+def run_image_task(path: str, checkpoint_dir: str = None):
+    # Task 4: Working with remote sensing images
+    checking_correctness(path, checkpoint_dir=checkpoint_dir)
+    calculating_image_statistics(path, checkpoint_dir=checkpoint_dir)
     retiling_images(path)
 
+
+def run_geoparquet_task(file_path: str):
     # Task 5: Working with geospatial vector data
-    file_path = "./untracked-files/milestone01/geoparquets/"
     print_avg_num_labels_geo(file_path)
     print_num_overlapping_patches(file_path)
 
+
+def run_split_task(metadata_path: str, output_path: str, backend: str = "pandas"):
     # Task 6: Creating train/test splits for deep learning
-    metadata_path = "./untracked-files/milestone01/metadata.parquet"
-    save_splits_to_csv(
-        metadata_path, output_path="./untracked-files/split.csv")
+    save_splits_to_csv(metadata_path, output_path=output_path, backend=backend)
+
+
+# Every stage lists the data it reads (inputs) and writes (outputs). Inputs, arguments
+# and the source code make up the cache fingerprint, a cached result is only reused
+# while all outputs still exist. Command line options override arguments of the same name.
+STAGES = {
+    "tabular": {
+        "function": run_tabular_task,
+        "args": {"path": "./untracked-files/milestone01/metadata.parquet", "backend": "pandas"},
+        "inputs": ["./untracked-files/milestone01/metadata.parquet"],
+        "outputs": [],
+        "depends_on": [],
+    },
+    "images": {
+        "function": run_image_task,
+        "args": {"path": "./untracked-files/milestone01/", "checkpoint_dir": None},
+        "inputs": ["./untracked-files/milestone01/metadata.parquet",
+                   "./untracked-files/milestone01/patches_for_stats.csv.gz",
+                   "./untracked-files/milestone01/BigEarthNet-v2.0-S2-with-errors/"],
+        "outputs": ["./untracked-files/re-tiled/"],
+        "depends_on": [],
+    },
+    "geoparquet": {
+        "function": run_geoparquet_task,
+        "args": {"file_path": "./untracked-files/milestone01/geoparquets/"},
+        "inputs": ["./untracked-files/milestone01/geoparquets/"],
+        "outputs": [],
+        "depends_on": [],
+    },
+    "splits": {
+        "function": run_split_task,
+        "args": {"metadata_path": "./untracked-files/milestone01/metadata.parquet",
+                 "output_path": "./untracked-files/split.csv", "backend": "pandas"},
+        "inputs": ["./untracked-files/milestone01/metadata.parquet"],
+        "outputs": ["./untracked-files/split.csv"],
+        "depends_on": [],
+    },
+}
+
+
+def _file_stats(path: str):
+    """Size and modification time stand in for the content, so large archives are not read.
+
+    A directory is walked recursively and every file below it is stat'ed, so a band
+    rewritten in place deep inside the archive changes the fingerprint as well.
+    """
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        yield path, stat.st_size, stat.st_mtime_ns
+        return
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for file_name in sorted(files):
+            file_path = os.path.join(root, file_name)
+            stat = os.stat(file_path)
+            yield os.path.relpath(file_path, path), stat.st_size, stat.st_mtime_ns
+
+
+@functools.cache
+def fingerprint_source() -> str:
+    """Hash of every Python file of the repository.
+
+    Stages import across packages (e.g. the splits use the tabular compact metadata
+    and the tracing), so any source change invalidates all cached results.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(REPO_PATH):
+        dirs[:] = sorted(d for d in dirs if d not in NON_SOURCE_DIRS and not d.startswith("."))
+        for file_name in sorted(files):
+            if file_name.endswith(".py"):
+                file_path = os.path.join(root, file_name)
+                digest.update(os.path.relpath(file_path, REPO_PATH).encode())
+                with open(file_path, "rb") as source_file:
+                    digest.update(source_file.read())
+    return digest.hexdigest()
+
+
+def stage_args(name: str, overrides: dict = None) -> dict:
+    args = dict(STAGES[name]["args"])
+    for key, value in (overrides or {}).items():
+        if key in args:
+            args[key] = value
+    return args
+
+
+def fingerprint_stage(name: str, args: dict) -> str:
+    stage = STAGES[name]
+    digest = hashlib.sha256()
+    digest.update(json.dumps([name, args], sort_keys=True).encode())
+    digest.update(fingerprint_source().encode())
+    for input_path in stage["inputs"]:
+        assert os.path.exists(input_path), f"Input of stage {name} does not exist: {input_path}"
+        digest.update(input_path.encode())
+        for entry in _file_stats(input_path):
+            digest.update(repr(entry).encode())
+    return digest.hexdigest()
+
+
+def _cache_path(cache_dir: str, name: str, fingerprint: str) -> str:
+    return os.path.join(cache_dir, f"{name}-{fingerprint}.json")
+
+
+def load_cached_output(cache_dir: str, name: str, fingerprint: str):
+    cache_path = _cache_path(cache_dir, name, fingerprint)
+    if not os.path.exists(cache_path):
+        return None
+    if not all(os.path.exists(output) for output in STAGES[name]["outputs"]):
+        return None
+    with open(cache_path) as cache_file:
+        return json.load(cache_file)["output"]
+
+
+def save_cached_output(cache_dir: str, name: str, fingerprint: str, output: str):
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(_cache_path(cache_dir, name, fingerprint), "w") as cache_file:
+        json.dump({"stage": name, "output": output}, cache_file)
+
+
+def run_stage(name: str, args: dict) -> str:
+    "Run one stage and return everything it printed"
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), traced_stage(name):
+        STAGES[name]["function"](**args)
+    return output.getvalue()
+
+
+def run_stages(names, workers: int = 4, use_cache: bool = True, cache_dir: str = CACHE_DIR, overrides: dict = None):
+    """Run the selected stages, independent ones concurrently in worker processes.
+
+    A stage starts once all stages it depends on are done. Its printed output is
+    cached under the stage fingerprint and replayed instead of rerunning it.
+    Repeated names run once.
+    """
+    names = list(dict.fromkeys(names))
+    for name in names:
+        assert name in STAGES, f"Unknown stage: {name}, expected one of {list(STAGES)}"
+        for dependency in STAGES[name]["depends_on"]:
+            assert dependency in names, f"Stage {name} depends on {dependency}, which is not selected"
+
+    done = set()
+    running = {}
+    fingerprints = {}
+
+    # Workers are spawned, forking after polars, duckdb and pyarrow started their threads can deadlock
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        while len(done) < len(names):
+            started = False
+            for name in names:
+                if name in done or name in running.values():
+                    continue
+                if not all(dependency in done for dependency in STAGES[name]["depends_on"]):
+                    continue
+
+                args = stage_args(name, overrides)
+                fingerprints[name] = fingerprint_stage(name, args)
+                cached = load_cached_output(
+                    cache_dir, name, fingerprints[name]) if use_cache else None
+                if cached is not None:
+                    print(cached, end="")
+                    done.add(name)
+                else:
+                    running[executor.submit(run_stage, name, args)] = name
+                started = True
+
+            if not running:
+                # Without a running stage, a pass that starts nothing can never make progress
+                assert started or len(done) == len(names), \
+                    f"Stages can never start: {[name for name in names if name not in done]}"
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                output = future.result()
+                print(output, end="")
+                if use_cache:
+                    save_cached_output(
+                        cache_dir, name, fingerprints[name], output)
+                done.add(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the milestone tasks")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES),
+                        help="stages to run (default: all)")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="number of stages to run concurrently")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="rerun every stage instead of replaying cached results")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help="directory with the cached stage results")
+    parser.add_argument("--backend", choices=["pandas", "polars", "arrow"], default="pandas",
+                        help="dataframe engine of the tabular and split stages")
+    parser.add_argument("--checkpoint-dir", default=None,
+                        help="persist partial results of the image scans here and resume from them after a crash")
+    parser.add_argument("--trace", default=os.environ.get(TRACE_ENV_VAR),
+                        help=f"append per-stage json metrics to this file, '-' for stderr (default: ${TRACE_ENV_VAR})")
+    args = parser.parse_args()
+
+    configure_tracing(args.trace)
+
+    run_stages(args.stages, workers=args.workers, use_cache=not args.no_cache,
+               cache_dir=args.cache_dir, overrides={"backend": args.backend, "checkpoint_dir": args.checkpoint_dir})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,24 @@
+import pytest
+
+from benchmarking.synthetic_dataset import generate_synthetic_dataset
+
+
+@pytest.fixture(scope="module")
+def archive_options():
+    "Keyword arguments of generate_synthetic_dataset, a test module overrides this fixture to change its archive"
+    return {}
+
+
+@pytest.fixture(scope="module")
+def synthetic_archive(tmp_path_factory, archive_options):
+    "Synthetic archive generated once per test module, as its root path and the injected error counts"
+    path = str(tmp_path_factory.mktemp("archive")) + "/"
+    expected = generate_synthetic_dataset(path, **archive_options)
+    return path, expected
+
+
+@pytest.fixture(scope="module")
+def archive(synthetic_archive):
+    "Root path of the synthetic archive, with a trailing slash"
+    path, _ = synthetic_archive
+    return path
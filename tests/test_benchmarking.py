@@ -0,0 +1,53 @@
+import json
+
+import pandas as pd
+import pytest
+import rasterio
+
+from benchmarking.synthetic_dataset import BAND_CODES, RETILING_TILE
+from benchmarking.benchmark import compare_to_baseline
+from working_with_remote_sensing_images.image_operations import checking_correctness, band_code_to_valid_size
+
+
+@pytest.fixture(scope="module")
+def archive_options():
+    return dict(num_tiles=2, grid_size=4, wrong_size_rate=0.3, no_data_rate=0.3, not_in_metadata_rate=0.2, seed=1)
+
+
+def test_generate_synthetic_dataset_layout(synthetic_archive):
+    path, expected = synthetic_archive
+
+    assert expected["num-patches"] == 2 * 4 * 4
+    with open(path + "expected.json") as expected_file:
+        assert json.load(expected_file) == expected
+
+    metadata = pd.read_parquet(path + "metadata.parquet")
+    assert len(metadata) == expected["num-patches"] - expected["not-part-of-dataset"]
+    stats = pd.read_csv(path + "patches_for_stats.csv.gz", compression="gzip")
+    assert set(stats["patch_id"]) <= set(metadata["patch_id"])
+
+    patch_id = f"{RETILING_TILE}_33_29"
+    for band_code in BAND_CODES:
+        band_path = f"{path}BigEarthNet-v2.0-S2-with-errors/{RETILING_TILE}/{patch_id}/{patch_id}_{band_code}.tif"
+        with rasterio.open(band_path) as band_reader:
+            assert band_reader.width == band_code_to_valid_size(band_code)
+            assert band_reader.crs is not None
+
+
+def test_checking_correctness_finds_injected_errors(synthetic_archive, capsys):
+    path, expected = synthetic_archive
+
+    checking_correctness(path)
+    captured = capsys.readouterr().out.split()
+
+    assert int(captured[captured.index("wrong-size:") + 1]) == expected["wrong-size"]
+    assert int(captured[captured.index("with-no-data:") + 1]) == expected["with-no-data"]
+    assert int(captured[captured.index("not-part-of-dataset:") + 1]) == expected["not-part-of-dataset"]
+
+
+def test_compare_to_baseline():
+    baseline = {"tiny": {"split_train_test": 1.0, "retiling_images": 1.0}}
+    results = {"tiny": {"split_train_test": 1.2, "retiling_images": 1.3, "checking_correctness": 5.0}}
+
+    assert compare_to_baseline(results, baseline, tolerance=0.25) == [
+        ("tiny", "retiling_images", 1.0, 1.3), ("tiny", "checking_correctness", None, 5.0)]
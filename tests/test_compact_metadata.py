@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from benchmarking.memory import measure_metadata_memory
+from working_with_tabular_data.compact_metadata import (
+    SEASONS,
+    SPLITS,
+    compact_metadata,
+    load_compact_metadata,
+    label_ids_and_offsets,
+    season_codes,
+)
+from working_with_tabular_data.tabular_operations import determine_season_from_patch_id
+
+LABELS = ["Arable land", "Beaches, dunes, sands", "Coniferous forest", "Marine waters", "Urban fabric"]
+
+
+@pytest.fixture
+def metadata_path(tmp_path):
+    rng = np.random.default_rng(0)
+    num_rows = 20000
+    tiles = ["T35ULA", "T35ULB", "T34VER"]
+    pd.DataFrame({
+        "patch_id": [f"S2B_MSIL2A_2017{month:02d}08T094029_N9999_R036_{tiles[tile]}_{h}_{v}" for month, tile, h, v in
+                     zip(rng.integers(1, 13, num_rows), rng.integers(0, 3, num_rows),
+                         rng.integers(0, 100, num_rows), rng.integers(0, 100, num_rows))],
+        "labels": [list(rng.choice(LABELS, size=rng.integers(1, 4), replace=False)) for _ in range(num_rows)],
+        "split": rng.choice(["train", "validation", "test"], num_rows),
+        "country": rng.choice(["Finland", "Portugal"], num_rows),
+    }).to_parquet(tmp_path / "metadata.parquet")
+    return str(tmp_path / "metadata.parquet")
+
+
+def test_load_compact_metadata_is_lossless(metadata_path):
+    expected = pd.read_parquet(metadata_path)
+    metadata = load_compact_metadata(metadata_path)
+
+    assert metadata["split"].type.index_type == pa.int8()
+    assert metadata["split"].combine_chunks().dictionary.to_pylist() == list(SPLITS)
+    assert metadata["country"].type.index_type == pa.int8()
+    assert metadata["labels"].type.value_type.index_type == pa.int8()
+    for column in expected.columns:
+        assert metadata[column].to_pylist() == [
+            list(value) if isinstance(value, np.ndarray) else value for value in expected[column]]
+
+
+def test_label_ids_and_offsets_of_sliced_labels():
+    metadata = compact_metadata(pa.table({"labels": [["b", "a"], ["c"], [], ["a", "c", "b"]]}))
+
+    label_ids, offsets, label_names = label_ids_and_offsets(metadata["labels"].slice(1))
+
+    assert label_names.to_pylist() == ["a", "b", "c"]
+    assert offsets.tolist() == [0, 1, 1, 4]
+    assert label_ids.tolist() == [2, 0, 2, 1]
+
+
+def test_season_codes_match_determine_season(metadata_path):
+    patch_ids = pd.read_parquet(metadata_path)["patch_id"]
+
+    codes = season_codes(pa.array(patch_ids))
+
+    assert [SEASONS[code] for code in codes] == patch_ids.apply(determine_season_from_patch_id).tolist()
+    with pytest.raises(AssertionError):
+        season_codes(pa.array(["S2A_MSIL2A_2023011_N0509_R123_T123_20230115T123456"]))
+    with pytest.raises(AssertionError):
+        season_codes(pa.array(["S2A_MSIL2A_20231315T000000_N0509_R123_T123_1_2"]))
+
+
+def test_compact_metadata_needs_less_memory(metadata_path):
+    memory = measure_metadata_memory(metadata_path)
+
+    assert memory["compact"] * 3 < memory["pandas"]
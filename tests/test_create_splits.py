@@ -0,0 +1,347 @@
+import numpy as np
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pytest
+
+from creating_splits_for_dl.create_splits import (
+    split_train_test,
+    parse_patch_ids,
+    compute_tile_windows,
+    iterative_stratification,
+    assign_spatial_folds,
+    spatial_k_fold,
+    save_splits_to_parquet,
+    load_splits,
+    save_tile_windows,
+    load_tile_windows,
+    StreamingSplitAssigner,
+    split_train_test_polars,
+    split_train_test_compact,
+    save_splits_to_csv,
+)
+from working_with_tabular_data.compact_metadata import compact_metadata
+
+
+def make_patch_id(tile_id: str, h: int, v: int, month: int = 8) -> str:
+    return f"S2B_MSIL2A_2017{month:02d}08T094029_N9999_R036_{tile_id}_{h}_{v}"
+
+
+def reference_split_train_test(metadata: pd.DataFrame, test_ratio: float = 0.2) -> pd.DataFrame:
+    # Original per-tile loop implementation, kept to check the vectorized version against
+    metadata = metadata.copy()
+    metadata['tile_id'] = metadata['patch_id'].apply(lambda p: p.split('_')[5])
+    metadata['H'] = metadata['patch_id'].apply(lambda p: int(p.split('_')[-2]))
+    metadata['V'] = metadata['patch_id'].apply(lambda p: int(p.split('_')[-1]))
+    metadata['split'] = 'train'
+
+    central_width_factor = np.sqrt(test_ratio)
+    for tile_id, group in metadata.groupby('tile_id'):
+        min_H, max_H = group['H'].min(), group['H'].max()
+        min_V, max_V = group['V'].min(), group['V'].max()
+        range_H = max_H - min_H + 1
+        range_V = max_V - min_V + 1
+        central_width_H = max(int(central_width_factor * range_H), 1)
+        central_width_V = max(int(central_width_factor * range_V), 1)
+        central_min_H = min_H + (range_H - central_width_H) // 2
+        central_min_V = min_V + (range_V - central_width_V) // 2
+        condition = (
+            (metadata['tile_id'] == tile_id) &
+            (metadata['H'] >= central_min_H) & (metadata['H'] < central_min_H + central_width_H) &
+            (metadata['V'] >= central_min_V) & (metadata['V'] < central_min_V + central_width_V)
+        )
+        metadata.loc[condition, 'split'] = 'test'
+    return metadata
+
+
+@pytest.fixture
+def random_metadata():
+    rng = np.random.default_rng(0)
+    patch_ids = []
+    for tile_idx in range(12):
+        tile_id = f"T{30 + tile_idx}ULA"
+        h_offset, v_offset = rng.integers(0, 20, size=2)
+        width, height = rng.integers(1, 15, size=2)
+        for h in range(width):
+            for v in range(height):
+                # Leave holes in the grid like the real archive
+                if rng.random() < 0.8:
+                    patch_ids.append(make_patch_id(
+                        tile_id, h_offset + h, v_offset + v))
+    patch_ids = list(rng.permutation(patch_ids))
+    return pd.DataFrame({
+        'patch_id': patch_ids,
+        'labels': [['Urban fabric']] * len(patch_ids),
+    }, index=rng.permutation(len(patch_ids)))
+
+
+@pytest.mark.parametrize("test_ratio", [0.05, 0.2, 0.5])
+def test_split_train_test_matches_reference(random_metadata, test_ratio):
+    result = split_train_test(random_metadata, test_ratio)
+    expected = reference_split_train_test(random_metadata, test_ratio)
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_split_train_test_does_not_modify_input(random_metadata):
+    columns = list(random_metadata.columns)
+    split_train_test(random_metadata)
+    assert list(random_metadata.columns) == columns
+
+
+def test_parse_patch_ids():
+    patch_ids = pd.Series([make_patch_id("T35ULA", 33, 29)])
+    parsed = parse_patch_ids(patch_ids)
+
+    assert parsed['tile_id'].tolist() == ['T35ULA']
+    assert parsed['H'].tolist() == [33]
+    assert parsed['V'].tolist() == [29]
+
+
+def test_parse_patch_ids_invalid_format():
+    with pytest.raises(AssertionError):
+        parse_patch_ids(pd.Series(['invalid_format']))
+    with pytest.raises(AssertionError):
+        parse_patch_ids(pd.Series(
+            ['S2B_MSIL2A_20170808T094029_N9999_R036_X35ULA_33_29']))
+
+
+def test_compute_tile_windows_single_patch_tile():
+    metadata = parse_patch_ids(pd.Series([make_patch_id("T35ULA", 3, 4)]))
+    windows = compute_tile_windows(metadata)
+
+    assert windows.loc['T35ULA'].tolist() == [3, 4, 4, 5]
+
+
+@pytest.fixture
+def labelled_metadata():
+    rng = np.random.default_rng(1)
+    common = ['Arable land', 'Coniferous forest', 'Pastures']
+    rare = ['Beaches, dunes, sands', 'Marine waters']
+    patch_ids, labels = [], []
+    for tile_idx in range(6):
+        tile_id = f"T{30 + tile_idx}ULA"
+        for h in range(24):
+            for v in range(24):
+                patch_labels = list(rng.choice(common, size=rng.integers(1, 3), replace=False))
+                # Rare labels are spatially clustered in a few corners of a few tiles
+                if tile_idx < 3 and h < 8 and v < 8:
+                    patch_labels.append(rare[tile_idx % 2])
+                patch_ids.append(make_patch_id(tile_id, h, v))
+                labels.append(patch_labels)
+    return pd.DataFrame({'patch_id': patch_ids, 'labels': labels})
+
+
+def test_stratified_split_keeps_blocks_together(labelled_metadata):
+    result = split_train_test(labelled_metadata, mode="stratified", block_size=4)
+
+    blocks = result.groupby([result['tile_id'], result['H'] // 4, result['V'] // 4])
+    assert (blocks['split'].nunique() == 1).all()
+
+
+def test_stratified_split_balances_labels(labelled_metadata):
+    result = split_train_test(labelled_metadata, test_ratio=0.25, mode="stratified", block_size=4)
+
+    exploded = result[['labels', 'split']].explode('labels')
+    test_fraction = exploded.groupby('labels')['split'].apply(lambda s: (s == 'test').mean())
+    # Every label, including the rare clustered ones, ends up in both splits
+    assert ((test_fraction > 0) & (test_fraction < 1)).all()
+    assert abs((result['split'] == 'test').mean() - 0.25) < 0.05
+
+
+def test_stratified_split_is_deterministic(labelled_metadata):
+    first = split_train_test(labelled_metadata, mode="stratified", seed=3)
+    second = split_train_test(labelled_metadata, mode="stratified", seed=3)
+    pd.testing.assert_series_equal(first['split'], second['split'])
+
+
+def test_iterative_stratification_matches_ratios():
+    # Four labels, every block carries exactly one of them
+    label_counts = np.repeat(np.eye(4, dtype=np.int64), 10, axis=0)
+    assignment = iterative_stratification(label_counts, np.ones(40, dtype=np.int64), [0.8, 0.2])
+
+    for label in range(4):
+        assert (assignment[label_counts[:, label] > 0] == 1).sum() == 2
+
+
+def test_split_train_test_unknown_mode(random_metadata):
+    with pytest.raises(AssertionError):
+        split_train_test(random_metadata, mode="random")
+
+
+def test_assign_spatial_folds_are_contiguous(random_metadata):
+    result = assign_spatial_folds(random_metadata, k=3)
+
+    assert result['fold'].dtype == np.int8
+    assert result['fold'].between(0, 2).all()
+    # Within a tile the folds are stripes ordered along its longer axis
+    for _, tile in result.groupby('tile_id'):
+        axis = 'V' if np.ptp(tile['V']) > np.ptp(tile['H']) else 'H'
+        bounds = tile.groupby('fold')[axis].agg(['min', 'max']).sort_index()
+        assert (bounds['max'].to_numpy()[:-1] < bounds['min'].to_numpy()[1:]).all()
+
+
+def test_assign_spatial_folds_cut_tall_tiles_along_V():
+    patch_ids = [make_patch_id("T35ULA", h, v) for h in range(2) for v in range(9)]
+
+    result = assign_spatial_folds(pd.DataFrame({'patch_id': patch_ids}), k=3)
+
+    # Cutting along H would leave one fold empty and the others one patch wide
+    assert result.groupby('fold')['V'].agg(['min', 'max']).values.tolist() == [[0, 2], [3, 5], [6, 8]]
+
+
+def test_spatial_k_fold_covers_every_patch_once(random_metadata):
+    folds = list(spatial_k_fold(random_metadata, k=4))
+
+    assert len(folds) == 4
+    test_indices = np.concatenate([test for _, test in folds])
+    assert np.array_equal(np.sort(test_indices), np.arange(len(random_metadata)))
+    for train, test in folds:
+        assert len(train) + len(test) == len(random_metadata)
+
+
+def test_spatial_k_fold_buffer_excludes_neighbours():
+    patch_ids = [make_patch_id("T35ULA", h, v) for h in range(10) for v in range(3)]
+    metadata = pd.DataFrame({'patch_id': patch_ids})
+    H = parse_patch_ids(metadata['patch_id'])['H'].to_numpy()
+
+    train, test = list(spatial_k_fold(metadata, k=5, buffer=1))[2]
+
+    assert set(H[test]) == {4, 5}
+    assert set(H[train]) == {0, 1, 2, 7, 8, 9}
+
+    # The buffer follows the axis a tall tile is cut along
+    tall = pd.DataFrame({'patch_id': [make_patch_id("T35ULA", h, v) for h in range(3) for v in range(10)]})
+    V = parse_patch_ids(tall['patch_id'])['V'].to_numpy()
+    train, test = list(spatial_k_fold(tall, k=5, buffer=1))[2]
+
+    assert set(V[test]) == {4, 5}
+    assert set(V[train]) == {0, 1, 2, 7, 8, 9}
+
+
+def write_metadata(tmp_path, metadata):
+    path = tmp_path / "metadata.parquet"
+    metadata.to_parquet(path)
+    return str(path)
+
+
+def test_save_and_load_splits_parquet(tmp_path, random_metadata):
+    metadata_path = write_metadata(tmp_path, random_metadata)
+    output_path = str(tmp_path / "splits" / "split.parquet")
+
+    save_splits_to_parquet(metadata_path, output_path, k=3)
+    splits = load_splits(output_path)
+    expected = split_train_test(random_metadata).set_index('patch_id')['split']
+
+    assert len(splits) == len(random_metadata)
+    assert pa.types.is_dictionary(splits.table.schema.field('split').type)
+    for patch_id in expected.index[:20]:
+        assert splits.split_of(patch_id) == expected[patch_id]
+        assert 0 <= splits.fold_of(patch_id) < 3
+    assert list(splits.splits_of(expected.index)) == list(expected)
+    for split in ('train', 'test'):
+        assert sorted(splits.patch_ids(split).to_pylist()) == sorted(expected.index[expected == split])
+
+
+def test_load_splits_without_folds(tmp_path, random_metadata):
+    metadata_path = write_metadata(tmp_path, random_metadata)
+    output_path = str(tmp_path / "split.parquet")
+
+    save_splits_to_parquet(metadata_path, output_path)
+    splits = load_splits(output_path)
+    patch_id = random_metadata['patch_id'].iloc[0]
+
+    assert patch_id in splits
+    assert "unknown" not in splits
+    assert splits.fold_of(patch_id) is None
+
+
+def test_streaming_assigner_matches_batch_split(tmp_path, random_metadata):
+    metadata_path = write_metadata(tmp_path, random_metadata)
+    windows_path = str(tmp_path / "windows.parquet")
+    save_splits_to_parquet(metadata_path, str(tmp_path / "split.parquet"), windows_path=windows_path)
+
+    assigner = StreamingSplitAssigner.from_file(windows_path)
+    expected = split_train_test(random_metadata).set_index('patch_id')['split']
+    patch_ids = random_metadata['patch_id']
+
+    # Assigning in small batches gives the same result as the full split
+    assigned = pd.concat([assigner.assign(patch_ids[i:i + 50]) for i in range(0, len(patch_ids), 50)])
+    assert list(assigned) == list(expected[assigned.index])
+
+
+def test_streaming_assigner_keeps_existing_assignments(tmp_path):
+    patch_ids = [make_patch_id("T35ULA", h, v) for h in range(5) for v in range(5)]
+    metadata = split_train_test(pd.DataFrame({'patch_id': patch_ids}))
+    windows_path = str(tmp_path / "windows.parquet")
+    save_tile_windows(compute_tile_windows(metadata), windows_path)
+
+    assigner = StreamingSplitAssigner.from_file(windows_path)
+    # Patches outside the old extents would move the central window of a recomputed split
+    new_ids = [make_patch_id("T35ULA", h, 0) for h in range(5, 15)]
+    assert (assigner.assign(new_ids) == 'train').all()
+
+    before = assigner.assign(patch_ids)
+    assigner.assign([make_patch_id("T36ULA", h, h) for h in range(1, 10)])
+    assert list(assigner.assign(patch_ids)) == list(metadata['split'])
+    assert list(before) == list(metadata['split'])
+
+    assigner.save(windows_path)
+    assert set(load_tile_windows(windows_path).index) == {"T35ULA", "T36ULA"}
+
+
+def test_streaming_assigner_leaves_narrow_new_tiles_unassigned():
+    known = split_train_test(pd.DataFrame({'patch_id': [make_patch_id("T35ULA", 0, 0)]}))
+    assigner = StreamingSplitAssigner(compute_tile_windows(known), min_extent=3)
+
+    # A single patch or a single row of patches does not fix the window of a new tile
+    assert assigner.assign([make_patch_id("T36ULA", 0, 0)]).isna().all()
+    assert assigner.assign([make_patch_id("T36ULA", h, 0) for h in range(10)]).isna().all()
+    assert "T36ULA" not in assigner.windows.index
+
+    # Resubmitted with patches spanning both axes, the tile gets the window of the full split
+    patch_ids = [make_patch_id("T36ULA", h, v) for h in range(10) for v in range(3)]
+    assigned = assigner.assign(patch_ids)
+    assert list(assigned) == list(split_train_test(pd.DataFrame({'patch_id': patch_ids}))['split'])
+
+
+@pytest.mark.parametrize("test_ratio", [0.05, 0.2, 0.5])
+def test_split_train_test_polars_matches_pandas(random_metadata, test_ratio):
+    expected = split_train_test(random_metadata[['patch_id']], test_ratio)
+    result = split_train_test_polars(pl.from_pandas(random_metadata[['patch_id']]), test_ratio).to_pandas()
+
+    for column in ['patch_id', 'tile_id', 'H', 'V', 'split']:
+        assert result[column].tolist() == expected[column].tolist()
+
+
+def test_split_train_test_polars_invalid_format():
+    with pytest.raises(AssertionError):
+        split_train_test_polars(pl.DataFrame({'patch_id': ['invalid_format']}))
+    with pytest.raises(AssertionError):
+        split_train_test_polars(pl.DataFrame(
+            {'patch_id': ['S2B_MSIL2A_20170808T094029_N9999_R036_T35ULA_3a_29']}))
+
+
+def test_save_splits_backends_match(tmp_path, random_metadata):
+    metadata_path = write_metadata(tmp_path, random_metadata)
+
+    save_splits_to_csv(metadata_path, str(tmp_path / "pandas.csv"))
+    save_splits_to_csv(metadata_path, str(tmp_path / "polars.csv"), backend="polars")
+    save_splits_to_csv(metadata_path, str(tmp_path / "arrow.csv"), backend="arrow",
+                       windows_path=str(tmp_path / "windows.parquet"))
+
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "pandas.csv"), pd.read_csv(tmp_path / "polars.csv"))
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "pandas.csv"), pd.read_csv(tmp_path / "arrow.csv"))
+    windows = compute_tile_windows(parse_patch_ids(random_metadata['patch_id']))
+    pd.testing.assert_frame_equal(load_tile_windows(str(tmp_path / "windows.parquet")).drop(columns='test_ratio'),
+                                  windows, check_index_type=False)
+
+
+@pytest.mark.parametrize("mode", ["central", "stratified"])
+def test_split_train_test_compact_matches_pandas(labelled_metadata, mode):
+    expected = split_train_test(labelled_metadata, mode=mode)
+    result = split_train_test_compact(compact_metadata(pa.Table.from_pandas(labelled_metadata)), mode=mode)
+
+    assert result['split'].type.index_type == pa.int8()
+    for column in ['patch_id', 'tile_id', 'H', 'V', 'split']:
+        assert result[column].to_pylist() == expected[column].tolist()
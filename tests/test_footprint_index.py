@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pyproj
+import pytest
+import rasterio
+
+from working_with_remote_sensing_images.footprint_index import FootprintIndex, build_footprint_index
+
+
+@pytest.fixture(scope="module")
+def archive_options():
+    # The two tiles of this seed lie in the UTM zones 35 and 33
+    return dict(num_tiles=2, grid_size=3, wrong_size_rate=0.0, seed=7)
+
+
+@pytest.fixture(scope="module")
+def index_path(archive, tmp_path_factory):
+    index_path = str(tmp_path_factory.mktemp("index") / "footprints.parquet")
+    footprints = build_footprint_index(archive, index_path, workers=2)
+
+    for row in footprints.itertuples():
+        band_path = f"{archive}BigEarthNet-v2.0-S2-with-errors/{row.tile}/{row.patch_id}/{row.patch_id}_B02.tif"
+        with rasterio.open(band_path) as band_reader:
+            assert (row.min_x, row.min_y, row.max_x, row.max_y) == tuple(band_reader.bounds)
+            assert row.crs == band_reader.crs.to_string()
+    return index_path
+
+
+@pytest.fixture
+def index(index_path, monkeypatch):
+    # Queries must only use the persisted index
+    def no_raster(*args, **kwargs):
+        raise AssertionError("raster opened during a query")
+    monkeypatch.setattr(rasterio, "open", no_raster)
+    return FootprintIndex(index_path)
+
+
+def lon_lat_centres(footprints):
+    "Centres of the footprints as longitude and latitude, each reprojected from the CRS of its band"
+    longitudes, latitudes = np.empty(len(footprints)), np.empty(len(footprints))
+    for crs, positions in footprints.groupby("crs").indices.items():
+        group = footprints.iloc[positions]
+        longitudes[positions], latitudes[positions] = pyproj.Transformer.from_crs(
+            crs, "EPSG:4326", always_xy=True).transform(((group["min_x"] + group["max_x"]) / 2).to_numpy(),
+                                                        ((group["min_y"] + group["max_y"]) / 2).to_numpy())
+    return longitudes, latitudes
+
+
+def test_query_points_finds_covering_patch(index):
+    footprints = index.footprints[index.footprints["crs"] == "EPSG:32635"]
+    centres_x = ((footprints["min_x"] + footprints["max_x"]) / 2).to_numpy()
+    centres_y = ((footprints["min_y"] + footprints["max_y"]) / 2).to_numpy()
+
+    matches = index.query_points(centres_x, centres_y, crs="EPSG:32635")
+    assert matches["query"].tolist() == list(range(len(footprints)))
+    assert matches["patch_id"].tolist() == footprints["patch_id"].tolist()
+
+    # The same points as longitude and latitude
+    longitudes, latitudes = pyproj.Transformer.from_crs("EPSG:32635", "EPSG:4326", always_xy=True).transform(
+        centres_x, centres_y)
+    assert index.query_points(longitudes, latitudes).equals(matches)
+
+    far_away = index.query_points([0.0], [0.0])
+    assert far_away.empty
+
+
+def test_query_points_across_crs(index):
+    footprints = index.footprints
+    assert sorted(footprints["crs"].unique()) == ["EPSG:32633", "EPSG:32635"]
+
+    # One query reaches the tiles of both UTM zones
+    matches = index.query_points(*lon_lat_centres(footprints))
+
+    assert matches["query"].tolist() == list(range(len(footprints)))
+    assert matches["patch_id"].tolist() == footprints["patch_id"].tolist()
+
+
+def test_query_bboxes_matches_brute_force(index):
+    # The tiles of the other zone lie far outside the bboxes, so the brute force only checks this CRS
+    footprints = index.footprints[index.footprints["crs"] == "EPSG:32635"]
+    rng = np.random.default_rng(0)
+    min_x = rng.uniform(footprints["min_x"].min() - 500, footprints["max_x"].max(), size=50)
+    min_y = rng.uniform(footprints["min_y"].min() - 500, footprints["max_y"].max(), size=50)
+    max_x, max_y = min_x + rng.uniform(1, 3000, size=50), min_y + rng.uniform(1, 3000, size=50)
+
+    matches = index.query_bboxes(min_x, min_y, max_x, max_y, crs="EPSG:32635")
+
+    for query in range(50):
+        # Footprints only touching the bbox edge also intersect it
+        expected = footprints[(footprints["min_x"] <= max_x[query]) & (footprints["max_x"] >= min_x[query]) &
+                              (footprints["min_y"] <= max_y[query]) & (footprints["max_y"] >= min_y[query])]
+        assert sorted(matches.loc[matches["query"] == query, "patch_id"]) == sorted(expected["patch_id"])
+
+
+def test_query_empty_index(tmp_path):
+    index_path = str(tmp_path / "footprints.parquet")
+    pd.DataFrame(columns=["patch_id", "tile", "crs", "footprint", "min_x", "min_y", "max_x", "max_y"]).to_parquet(
+        index_path, index=False)
+
+    index = FootprintIndex(index_path)
+
+    assert len(index) == 0
+    assert index.query_points([25.0], [60.0]).columns.tolist() == ["query", "patch_id", "tile"]
+    assert index.query_bboxes([25.0], [60.0], [26.0], [61.0]).empty
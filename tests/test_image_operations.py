@@ -0,0 +1,126 @@
+import os
+
+import numpy as np
+import pytest
+
+from benchmarking.synthetic_dataset import generate_synthetic_dataset, tile_crs, write_band
+from working_with_remote_sensing_images import image_operations
+from working_with_remote_sensing_images.image_operations import checking_correctness, calculating_image_statistics
+
+
+class SimulatedCrash(Exception):
+    pass
+
+
+@pytest.fixture(scope="module")
+def archive_options():
+    return dict(num_tiles=3, grid_size=3, wrong_size_rate=0.3, no_data_rate=0.3, not_in_metadata_rate=0.2,
+                stats_rate=0.6, seed=2)
+
+
+def crash_after(monkeypatch, function_name, num_calls):
+    original = getattr(image_operations, function_name)
+    calls = []
+
+    def crashing(*args, **kwargs):
+        calls.append(1)
+        if len(calls) > num_calls:
+            raise SimulatedCrash()
+        return original(*args, **kwargs)
+    monkeypatch.setattr(image_operations, function_name, crashing)
+
+
+def test_calculating_image_statistics_resumes_after_crash(archive, tmp_path, monkeypatch, capsys):
+    expected = calculating_image_statistics(archive)
+    expected_output = capsys.readouterr().out
+    checkpoint_dir = str(tmp_path / "checkpoints")
+
+    # Crash in the middle of the second pass, after some shards were checkpointed
+    crash_after(monkeypatch, "count_and_sumSqDev", 40)
+    with pytest.raises(SimulatedCrash):
+        calculating_image_statistics(archive, checkpoint_dir=checkpoint_dir, shard_size=2)
+    monkeypatch.undo()
+
+    # The resumed run must not redo the first pass
+    crash_after(monkeypatch, "count_and_sum", 0)
+    resumed = calculating_image_statistics(archive, checkpoint_dir=checkpoint_dir, shard_size=2)
+
+    assert resumed == expected
+    assert capsys.readouterr().out == expected_output
+
+
+def test_checking_correctness_resumes_after_crash(archive, tmp_path, monkeypatch, capsys):
+    checking_correctness(archive)
+    expected_output = capsys.readouterr().out
+    checkpoint_dir = str(tmp_path / "checkpoints")
+
+    crash_after(monkeypatch, "check_tile", 1)
+    with pytest.raises(SimulatedCrash):
+        checking_correctness(archive, checkpoint_dir=checkpoint_dir)
+    monkeypatch.undo()
+
+    checked_tiles = []
+    original_check_tile = image_operations.check_tile
+    monkeypatch.setattr(image_operations, "check_tile",
+                        lambda tile_path, *args: checked_tiles.append(tile_path) or original_check_tile(tile_path, *args))
+    checking_correctness(archive, checkpoint_dir=checkpoint_dir)
+
+    assert len(checked_tiles) == 2
+    assert capsys.readouterr().out == expected_output
+
+
+
+def rewrite_band(path, patch_index, band_code, wrong_size=False):
+    "Rewrite one band of a patch of the first tile in place with new pixels"
+    dataset_path = path + "BigEarthNet-v2.0-S2-with-errors/"
+    tile_name = sorted(os.listdir(dataset_path))[0]
+    patch_id = sorted(os.listdir(dataset_path + tile_name))[patch_index]
+    write_band(f"{dataset_path}{tile_name}/{patch_id}/{patch_id}_{band_code}.tif", band_code, tile_crs(tile_name),
+               0.0, 0.0, np.random.default_rng(patch_index), wrong_size=wrong_size)
+
+
+@pytest.fixture
+def clean_archive(tmp_path):
+    # Own archive, as its bands are rewritten
+    path = str(tmp_path / "archive") + "/"
+    generate_synthetic_dataset(path, num_tiles=2, grid_size=2, wrong_size_rate=0.0, not_in_metadata_rate=0.0,
+                               stats_rate=1.0, seed=8)
+    return path
+
+
+def test_checking_correctness_rechecks_bands_changed_after_a_finished_run(clean_archive, tmp_path, capsys):
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    checking_correctness(clean_archive, checkpoint_dir=checkpoint_dir)
+    assert "wrong-size:  0" in capsys.readouterr().out
+    assert os.listdir(checkpoint_dir) == []
+
+    rewrite_band(clean_archive, 0, "B03", wrong_size=True)
+    checking_correctness(clean_archive, checkpoint_dir=checkpoint_dir)
+    assert "wrong-size:  1" in capsys.readouterr().out
+
+
+def test_checking_correctness_rechecks_bands_changed_before_a_resume(clean_archive, tmp_path, monkeypatch, capsys):
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    crash_after(monkeypatch, "check_tile", 1)
+    with pytest.raises(SimulatedCrash):
+        checking_correctness(clean_archive, checkpoint_dir=checkpoint_dir)
+    monkeypatch.undo()
+
+    # The checkpointed first tile changes while the run is interrupted
+    rewrite_band(clean_archive, 1, "B02", wrong_size=True)
+    checking_correctness(clean_archive, checkpoint_dir=checkpoint_dir)
+    assert "wrong-size:  1" in capsys.readouterr().out
+
+
+def test_calculating_image_statistics_reprocesses_changed_bands(clean_archive, tmp_path, monkeypatch):
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    crash_after(monkeypatch, "count_and_sumSqDev", 20)
+    with pytest.raises(SimulatedCrash):
+        calculating_image_statistics(clean_archive, checkpoint_dir=checkpoint_dir, shard_size=2)
+    monkeypatch.undo()
+
+    rewrite_band(clean_archive, 0, "B04")
+    resumed = calculating_image_statistics(clean_archive, checkpoint_dir=checkpoint_dir, shard_size=2)
+
+    assert resumed == calculating_image_statistics(clean_archive)
+    assert os.listdir(checkpoint_dir) == []
@@ -0,0 +1,61 @@
+import pytest
+
+import main
+
+
+def stub_stage(depends_on=()):
+    return {"function": print, "args": {}, "inputs": [], "outputs": [], "depends_on": list(depends_on)}
+
+
+def test_run_stages_runs_repeated_stage_once(monkeypatch, tmp_path, capsys):
+    monkeypatch.setitem(main.STAGES, "stub", stub_stage())
+    cache_dir = str(tmp_path)
+    main.save_cached_output(cache_dir, "stub", main.fingerprint_stage("stub", {}), "cached output\n")
+
+    main.run_stages(["stub", "stub"], workers=1, cache_dir=cache_dir)
+
+    assert capsys.readouterr().out == "cached output\n"
+
+
+def test_run_stages_fails_on_stages_that_never_start(monkeypatch, tmp_path):
+    monkeypatch.setitem(main.STAGES, "first", stub_stage(depends_on=["second"]))
+    monkeypatch.setitem(main.STAGES, "second", stub_stage(depends_on=["first"]))
+
+    with pytest.raises(AssertionError, match="can never start"):
+        main.run_stages(["first", "second"], workers=1, cache_dir=str(tmp_path))
+
+
+def test_fingerprint_source_covers_imported_packages(monkeypatch, tmp_path):
+    (tmp_path / "working_with_tabular_data").mkdir()
+    module = tmp_path / "working_with_tabular_data" / "compact_metadata.py"
+    module.write_text("SEASONS = ()\n")
+    (tmp_path / "tests").mkdir()
+    monkeypatch.setattr(main, "REPO_PATH", str(tmp_path))
+
+    main.fingerprint_source.cache_clear()
+    before = main.fingerprint_source()
+    (tmp_path / "tests" / "test_new.py").write_text("")
+    main.fingerprint_source.cache_clear()
+    assert main.fingerprint_source() == before
+
+    module.write_text("SEASONS = ('spring',)\n")
+    main.fingerprint_source.cache_clear()
+    assert main.fingerprint_source() != before
+    main.fingerprint_source.cache_clear()
+
+
+def test_fingerprint_stage_misses_on_bands_rewritten_in_place(monkeypatch, tmp_path):
+    band = tmp_path / "archive" / "T35ULA" / "T35ULA_1_1" / "T35ULA_1_1_B02.tif"
+    band.parent.mkdir(parents=True)
+    band.write_bytes(b"band")
+    stage = dict(stub_stage(), inputs=[str(tmp_path / "archive")])
+    monkeypatch.setitem(main.STAGES, "stub", stage)
+
+    before = main.fingerprint_stage("stub", {})
+    assert main.fingerprint_stage("stub", {}) == before
+
+    # Two levels below the input, the mtimes of the tile and patch directories stay the same
+    tile_mtime = (tmp_path / "archive" / "T35ULA").stat().st_mtime_ns
+    band.write_bytes(b"wrong-sized band")
+    assert (tmp_path / "archive" / "T35ULA").stat().st_mtime_ns == tile_mtime
+    assert main.fingerprint_stage("stub", {}) != before
@@ -0,0 +1,68 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import rioxarray
+from geocube.api.core import make_geocube
+
+from benchmarking.synthetic_dataset import generate_synthetic_dataset
+from working_with_geospatial_vector_data import rasterizing
+from working_with_geospatial_vector_data.rasterizing import rasterize_patch_masks, load_patch_mask, NO_CLASS
+
+
+@pytest.fixture(scope="module")
+def archive_options():
+    return dict(num_tiles=2, grid_size=3, wrong_size_rate=0.0, overlap_rate=0.3, seed=4)
+
+
+def test_masks_match_geocube(archive, tmp_path):
+    masks = rasterize_patch_masks(archive, str(tmp_path), workers=2, batch_size=4)
+    assert len(masks) == len(os.listdir(archive + "geoparquets"))
+
+    for patch_id, cache_path in masks.items():
+        mask = np.load(cache_path)
+        polygons = gpd.read_parquet(f"{archive}geoparquets/{patch_id}.parquet")
+        tile_name = patch_id.rsplit("_", 2)[0]
+        band = rioxarray.open_rasterio(
+            f"{archive}BigEarthNet-v2.0-S2-with-errors/{tile_name}/{patch_id}/{patch_id}_B02.tif")
+        expected = make_geocube(vector_data=polygons, measurements=["DN"], like=band, fill=NO_CLASS)["DN"]
+
+        assert mask.dtype == np.uint16 and mask.shape == (120, 120)
+        np.testing.assert_array_equal(mask, expected.values.astype(np.uint16))
+
+
+def test_masks_are_cached_per_geoparquet_fingerprint(tmp_path, capsys):
+    # Own archive, as one of its geoparquets is rewritten
+    archive = str(tmp_path / "archive") + "/"
+    generate_synthetic_dataset(archive, num_tiles=2, grid_size=3, seed=5)
+    cache_dir = str(tmp_path / "masks")
+    masks = rasterize_patch_masks(archive, cache_dir, workers=2)
+    assert "rasterized-masks: 18" in capsys.readouterr().out
+
+    rasterize_patch_masks(archive, cache_dir, workers=2)
+    assert "rasterized-masks: 0\ncached-masks: 18" in capsys.readouterr().out
+
+    # Relabelling one patch only rebuilds its mask and drops the outdated one
+    patch_id = sorted(masks)[0]
+    geoparquet_file = f"{archive}geoparquets/{patch_id}.parquet"
+    polygons = gpd.read_parquet(geoparquet_file)
+    polygons["DN"] = 999
+    polygons.to_parquet(geoparquet_file)
+
+    new_masks = rasterize_patch_masks(archive, cache_dir, workers=2)
+    assert "rasterized-masks: 1\ncached-masks: 17" in capsys.readouterr().out
+    assert new_masks[patch_id] != masks[patch_id] and not os.path.exists(masks[patch_id])
+    assert set(np.unique(load_patch_mask(archive, patch_id, cache_dir))) <= {NO_CLASS, 999}
+
+
+def test_load_patch_mask_hits_the_manifest(archive, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path)
+    masks = rasterize_patch_masks(archive, cache_dir, workers=2)
+
+    # A fresh process reads the persisted manifest, neither the geoparquet nor the band is opened on a hit
+    monkeypatch.setattr(rasterizing, "_manifests", {})
+    monkeypatch.setattr(rasterizing, "patch_grid", None)
+    monkeypatch.setattr(rasterizing, "fingerprint_mask", None)
+    for patch_id, cache_path in masks.items():
+        np.testing.assert_array_equal(load_patch_mask(archive, patch_id, cache_dir), np.load(cache_path))
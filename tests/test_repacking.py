@@ -0,0 +1,68 @@
+import json
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import Affine
+
+from working_with_remote_sensing_images.image_operations import checking_correctness, calculating_image_statistics
+from working_with_remote_sensing_images.repacking import (RepackedArchive, repack_archive, checking_correctness_repacked,
+                                                          calculating_image_statistics_repacked)
+
+
+@pytest.fixture(scope="module")
+def archive_options():
+    return dict(num_tiles=2, grid_size=3, wrong_size_rate=0.3, no_data_rate=0.3, not_in_metadata_rate=0.2,
+                stats_rate=0.6, seed=3)
+
+
+@pytest.fixture(scope="module")
+def repacked(archive, tmp_path_factory):
+    repacked_path = str(tmp_path_factory.mktemp("repacked"))
+    repack_archive(archive, repacked_path, workers=2)
+    return archive, repacked_path
+
+
+def test_repack_archive_is_lossless(repacked):
+    path, repacked_path = repacked
+    dataset_path = path + "BigEarthNet-v2.0-S2-with-errors/"
+
+    assert len([file for file in os.listdir(repacked_path) if file.endswith(".tif")]) == 2
+    with RepackedArchive(repacked_path) as archive:
+        assert len(archive.index) == sum(len(files) for _, _, files in os.walk(dataset_path))
+        for row in archive.index.itertuples():
+            band_path = f"{dataset_path}{row.tile}/{row.patch_id}/{row.patch_id}_{row.band}.tif"
+            profile = archive.profile(row.patch_id, row.band)
+            with rasterio.open(band_path) as band_reader:
+                np.testing.assert_array_equal(archive.read(row.patch_id, row.band), band_reader.read(1))
+                assert profile["transform"] == band_reader.transform
+                assert profile["crs"] == band_reader.crs.to_string()
+                assert profile["nodata"] == band_reader.nodata
+                assert (profile["height"], profile["width"]) == (band_reader.height, band_reader.width)
+
+            # GDAL users find the georeferencing of every plane in its tags
+            dataset = archive.dataset(row.file, row.directory)
+            assert dataset.descriptions[row.plane - 1] == f"{row.patch_id}_{row.band}"
+            assert Affine(*json.loads(dataset.tags(row.plane)["TRANSFORM"])) == profile["transform"]
+            assert "index.parquet" in dataset.tags()["GEOREFERENCING"]
+
+
+def test_checking_correctness_repacked_matches(repacked, capsys):
+    path, repacked_path = repacked
+
+    checking_correctness(path)
+    expected = capsys.readouterr().out
+    checking_correctness_repacked(path, repacked_path)
+
+    assert capsys.readouterr().out == expected
+
+
+def test_calculating_image_statistics_repacked_matches(repacked, capsys):
+    path, repacked_path = repacked
+
+    expected = calculating_image_statistics(path)
+    expected_output = capsys.readouterr().out
+
+    assert calculating_image_statistics_repacked(path, repacked_path) == expected
+    assert capsys.readouterr().out == expected_output
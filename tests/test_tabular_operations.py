@@ -3,7 +3,11 @@ import pandas as pd
 from working_with_tabular_data.tabular_operations import (
     determine_season_from_patch_id,
     count_rows_per_season,
-    add_season_column_to_metadata
+    add_season_column_to_metadata,
+    count_rows_per_season_polars,
+    print_counts_per_season,
+    print_avg_num_labels,
+    print_max_num_labels
 )
 # Test data
 
@@ -74,3 +78,18 @@ def test_count_rows_per_season(sample_metadata):
 def test_load_metadata_nonexistent_file():
     with pytest.raises(AssertionError):
         load_metadata("nonexistent_file.parquet")
+
+
+def test_backends_match_pandas(sample_metadata, tmp_path, capsys):
+    metadata_path = str(tmp_path / "metadata.parquet")
+    sample_metadata.to_parquet(metadata_path)
+
+    outputs = []
+    for backend in ["pandas", "polars", "arrow"]:
+        print_counts_per_season(metadata_path, backend=backend)
+        print_avg_num_labels(metadata_path, backend=backend)
+        print_max_num_labels(metadata_path, backend=backend)
+        outputs.append(capsys.readouterr().out)
+
+    assert outputs[0] == outputs[1] == outputs[2]
+    assert count_rows_per_season_polars(metadata_path) == (1, 1, 1, 1)
@@ -0,0 +1,81 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from instrumentation import tracing
+from working_with_tabular_data.tabular_operations import print_avg_num_labels
+
+
+@pytest.fixture
+def trace_path(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    tracing.configure(str(path))
+    yield path
+    tracing.configure(None)
+
+
+def read_records(path):
+    with open(path) as trace_file:
+        return [json.loads(line) for line in trace_file]
+
+
+def test_stage_records_metrics(trace_path, tmp_path):
+    data_path = tmp_path / "data.bin"
+    data_path.write_bytes(b"x" * 100)
+
+    with tracing.stage("outer"):
+        tracing.record_file_read(str(data_path))
+        with tracing.stage("inner"):
+            tracing.record_parquet_rows(7)
+            with tracing.duckdb_query():
+                pass
+
+    inner, outer = read_records(trace_path)
+    assert inner["stage"] == "inner" and outer["stage"] == "outer"
+    assert outer["files_opened"] == 1 and outer["bytes_read"] == 100
+    # Counters of inner stages also count towards the stages around them
+    assert inner["parquet_rows_scanned"] == outer["parquet_rows_scanned"] == 7
+    assert inner["files_opened"] == 0
+    for key in ["wall_seconds", "cpu_seconds", "rss_start_mb", "rss_end_mb", "peak_rss_mb",
+                "duckdb_query_seconds"]:
+        assert outer[key] >= 0
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/clear_refs"), reason="the peak RSS can only be reset on Linux")
+def test_peak_rss_is_measured_per_stage(trace_path):
+    with tracing.stage("outer"):
+        with tracing.stage("large"):
+            large = np.ones(2**27, dtype=np.uint8)
+            del large
+        with tracing.stage("small"):
+            pass
+
+    large, small, outer = read_records(trace_path)
+    # The 128 MB of the earlier stage neither count towards the later one nor get lost for the outer one
+    assert large["peak_rss_mb"] - large["rss_start_mb"] >= 120
+    assert small["peak_rss_mb"] < large["peak_rss_mb"] - 100
+    assert outer["peak_rss_mb"] >= large["peak_rss_mb"]
+
+
+def test_instrumented_task(trace_path, tmp_path, capsys):
+    metadata_path = tmp_path / "metadata.parquet"
+    pd.DataFrame({"patch_id": ["a", "b"], "labels": [["x"], ["x", "y"]]}).to_parquet(metadata_path)
+
+    print_avg_num_labels(str(metadata_path))
+
+    assert "average-num-labels: 1.5" in capsys.readouterr().out
+    (record,) = read_records(trace_path)
+    assert record["stage"].endswith("print_avg_num_labels")
+    assert record["parquet_rows_scanned"] == 2
+    assert record["files_opened"] == 1
+
+
+def test_tracing_disabled_writes_nothing(tmp_path):
+    tracing.configure(None)
+    assert not tracing.is_enabled()
+    with tracing.stage("ignored"):
+        tracing.record_parquet_rows(1)
+    assert list(tmp_path.iterdir()) == []
@@ -1,25 +1,36 @@
 import duckdb
+import glob
+
+from instrumentation.tracing import instrumented, is_enabled, record_file_read, record_parquet_rows, duckdb_query
 
 CLASS_IDS = [111, 112, 121, 122, 123, 124, 131, 132, 133, 141, 142, 211, 212, 213, 221, 222, 223, 231, 241, 242, 243,
              244, 311, 312, 313, 321, 322, 323, 324, 331, 332, 333, 334, 335, 411, 412, 421, 422, 423, 511, 512, 521, 522, 523, 999]
 
 
+@instrumented()
 def analyze_label_stats_of_geoparquet_files(file_path: str):
     # Load the geoparquet files using duckdb
     conn = duckdb.connect(database=':memory:')
     conn.execute("INSTALL spatial;")
     conn.execute("LOAD spatial;")
 
+    if is_enabled():
+        for parquet_file in glob.glob(f"{file_path}/*.parquet"):
+            record_file_read(parquet_file)
+
     # Check if each field in the DN column contains exactly one integer
     QUERY_CHECK_DN_FIELD = f"SELECT DN FROM read_parquet('{
         file_path}/*.parquet')"
-    dn_df = conn.execute(QUERY_CHECK_DN_FIELD).df()
+    with duckdb_query():
+        dn_df = conn.execute(QUERY_CHECK_DN_FIELD).df()
+    record_parquet_rows(len(dn_df))
     assert all(isinstance(x, int) for x in dn_df['DN'])
 
     # Check if all class ids from the parquet files are valid
     QUERY_VALIDATE_CLASS_IDS = f"SELECT DISTINCT DN FROM read_parquet('{
         file_path}/*.parquet')"
-    class_ids = conn.execute(QUERY_VALIDATE_CLASS_IDS).df()
+    with duckdb_query():
+        class_ids = conn.execute(QUERY_VALIDATE_CLASS_IDS).df()
     class_ids = class_ids['DN'].tolist()
     assert all(class_id in CLASS_IDS for class_id in class_ids)
 
@@ -43,7 +54,8 @@ def analyze_label_stats_of_geoparquet_files(file_path: str):
     """
 
     # Extract the associated multi-label set omitting the UNLABELED label & calculate the average number per patch
-    label_stats_df = conn.execute(QUERY_LABEL_STATS).df()
+    with duckdb_query():
+        label_stats_df = conn.execute(QUERY_LABEL_STATS).df()
 
     return label_stats_df
 
@@ -88,33 +100,37 @@ def create_unified_patches_table(conn):
 
 def populate_unified_patches(conn, files):
     for idx, file_path in enumerate(files['file']):
-        conn.execute(f"""
-            INSERT INTO unified_patches
-            SELECT
-                {idx} as patch_id,
-                ST_Union_Agg(geometry) as unified_geometry
-            FROM read_parquet('{file_path}')
-        """)
+        record_file_read(file_path)
+        with duckdb_query():
+            conn.execute(f"""
+                INSERT INTO unified_patches
+                SELECT
+                    {idx} as patch_id,
+                    ST_Union_Agg(geometry) as unified_geometry
+                FROM read_parquet('{file_path}')
+            """)
 
 
 def calculate_overlapping_patches(conn) -> int:
-    overlaps = conn.execute("""
-        WITH overlap_counts AS (
-            SELECT 
-                a.patch_id,
-                COUNT(*) as num_overlaps
-            FROM unified_patches a
-            JOIN unified_patches b ON a.patch_id < b.patch_id
-            WHERE ST_Intersects(a.unified_geometry, b.unified_geometry)
-            GROUP BY a.patch_id
-        )
-        SELECT COUNT(*) as total_overlaps
-        FROM overlap_counts
-    """).df()
+    with duckdb_query():
+        overlaps = conn.execute("""
+            WITH overlap_counts AS (
+                SELECT 
+                    a.patch_id,
+                    COUNT(*) as num_overlaps
+                FROM unified_patches a
+                JOIN unified_patches b ON a.patch_id < b.patch_id
+                WHERE ST_Intersects(a.unified_geometry, b.unified_geometry)
+                GROUP BY a.patch_id
+            )
+            SELECT COUNT(*) as total_overlaps
+            FROM overlap_counts
+        """).df()
 
     return int(overlaps['total_overlaps'][0])
 
 
+@instrumented()
 def get_num_overlapping_patches(file_path: str) -> int:
     conn = create_duckdb_connection()
     create_unified_patches_table(conn)
@@ -0,0 +1,184 @@
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+from rasterio import features
+
+from instrumentation.tracing import instrumented, record_file_read, record_parquet_rows
+from working_with_remote_sensing_images.image_operations import band_code_to_valid_size
+
+# Pixels not covered by any polygon, the class ids in DN start at 111
+NO_CLASS = 0
+# The masks are aligned to the grid of this 10 m band
+GRID_BAND = "B02"
+# Bump to invalidate all cached masks when the rasterization changes
+MASK_VERSION = 1
+# patch_id -> [geoparquet size, geoparquet mtime, mask fingerprint] of the cached masks
+MANIFEST_FILE = "manifest.json"
+
+# Manifests already loaded by this process, by cache directory
+_manifests = {}
+
+
+def patch_grid(path: str, patch_id: str) -> dict:
+    "Transform, shape and CRS of the 10 m band grid of a patch, read from the band header"
+    tile_name = patch_id.rsplit("_", 2)[0]
+    band_path = f"{path}BigEarthNet-v2.0-S2-with-errors/{tile_name}/{patch_id}/{patch_id}_{GRID_BAND}.tif"
+    record_file_read(band_path)
+    with rasterio.open(band_path) as band_reader:
+        # A band with wrong size keeps its origin, the mask always has the valid size
+        size = band_code_to_valid_size(GRID_BAND)
+        return {"transform": band_reader.transform, "shape": (size, size), "crs": band_reader.crs}
+
+
+def fingerprint_mask(geoparquet_file: str, grid: dict) -> str:
+    "Hash of the polygons file content and the target grid, a mask is rebuilt whenever one of them changes"
+    digest = hashlib.sha256()
+    digest.update(repr((MASK_VERSION, tuple(grid["transform"]), grid["shape"], grid["crs"].to_string())).encode())
+    with open(geoparquet_file, "rb") as geoparquet:
+        digest.update(geoparquet.read())
+    return digest.hexdigest()
+
+
+def rasterize_polygons(polygons: gpd.GeoDataFrame, grid: dict) -> np.ndarray:
+    "Burn the DN class ids into a uint16 mask, later polygons win where polygons overlap"
+    if polygons.crs is not None and grid["crs"] is not None and polygons.crs != grid["crs"]:
+        polygons = polygons.to_crs(grid["crs"])
+    shapes = [(geometry, int(class_id)) for geometry, class_id in zip(polygons.geometry, polygons["DN"])
+              if geometry is not None and not geometry.is_empty]
+    if not shapes:
+        return np.full(grid["shape"], NO_CLASS, dtype=np.uint16)
+    return features.rasterize(shapes, out_shape=grid["shape"], transform=grid["transform"],
+                              fill=NO_CLASS, dtype=np.uint16)
+
+
+def mask_cache_path(cache_dir: str, patch_id: str, fingerprint: str) -> str:
+    return os.path.join(cache_dir, f"{patch_id}-{fingerprint}.npy")
+
+
+def load_manifest(cache_dir: str) -> dict:
+    "Manifest of a cache directory, read once per process"
+    cache_dir = os.path.abspath(cache_dir)
+    if cache_dir not in _manifests:
+        manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+        _manifests[cache_dir] = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as manifest_file:
+                _manifests[cache_dir] = json.load(manifest_file)
+    return _manifests[cache_dir]
+
+
+def save_manifest(cache_dir: str):
+    # Concurrent writers may drop each other's entries, which only costs a fingerprint on the next lookup
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w") as manifest_file:
+        json.dump(load_manifest(cache_dir), manifest_file)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def _geoparquet_file(path: str, patch_id: str) -> str:
+    return f"{path}geoparquets/{patch_id}.parquet"
+
+
+def _manifest_key(geoparquet_file: str) -> list:
+    stat = os.stat(geoparquet_file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def rasterize_patch_mask(path: str, patch_id: str, cache_dir: str, entry: list = None) -> tuple:
+    """Build the mask of one patch unless it is cached, returns the cache path, whether it was built
+    and the manifest entry. While the geoparquet keeps the size and mtime of the entry, the mask is
+    found without hashing the geoparquet or reading the band header."""
+    geoparquet_file = _geoparquet_file(path, patch_id)
+    manifest_key = _manifest_key(geoparquet_file)
+    if entry is not None and entry[:2] == manifest_key:
+        cache_path = mask_cache_path(cache_dir, patch_id, entry[2])
+        if os.path.exists(cache_path):
+            return cache_path, False, entry
+
+    grid = patch_grid(path, patch_id)
+    fingerprint = fingerprint_mask(geoparquet_file, grid)
+    cache_path = mask_cache_path(cache_dir, patch_id, fingerprint)
+    entry = manifest_key + [fingerprint]
+    if os.path.exists(cache_path):
+        return cache_path, False, entry
+
+    record_file_read(geoparquet_file)
+    polygons = gpd.read_parquet(geoparquet_file)
+    record_parquet_rows(len(polygons))
+    mask = rasterize_polygons(polygons, grid)
+
+    # Masks of outdated fingerprints are dropped, the new one is moved in atomically
+    for stale_path in glob.glob(mask_cache_path(cache_dir, patch_id, "*")):
+        os.remove(stale_path)
+    temporary_path = cache_path + ".tmp.npy"
+    np.save(temporary_path, mask)
+    os.replace(temporary_path, cache_path)
+    return cache_path, True, entry
+
+
+def _rasterize_patch_masks(path: str, patch_ids: list, cache_dir: str, entries: list) -> list:
+    return [rasterize_patch_mask(path, patch_id, cache_dir, entry) for patch_id, entry in zip(patch_ids, entries)]
+
+
+@instrumented()
+def rasterize_patch_masks(path: str, cache_dir: str, workers: int = 4, batch_size: int = 256) -> dict:
+    """Rasterize the polygons of every geoparquet below path into a uint16 class mask on the 10 m
+    band grid of its patch. Batches of patches run in parallel processes, cached masks are reused."""
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = load_manifest(cache_dir)
+    patch_ids = sorted(os.path.basename(geoparquet_file)[:-len(".parquet")]
+                       for geoparquet_file in glob.glob(f"{path}geoparquets/*.parquet"))
+    batches = [patch_ids[start:start + batch_size] for start in range(0, len(patch_ids), batch_size)]
+    batch_entries = [[manifest.get(patch_id) for patch_id in batch] for batch in batches]
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        results = [result for batch in executor.map(_rasterize_patch_masks, [path] * len(batches), batches,
+                                                    [cache_dir] * len(batches), batch_entries)
+                   for result in batch]
+
+    for patch_id, (_, _, entry) in zip(patch_ids, results):
+        manifest[patch_id] = entry
+    save_manifest(cache_dir)
+
+    num_built = sum(built for _, built, _ in results)
+    print(f"rasterized-masks: {num_built}\ncached-masks: {len(results) - num_built}")
+    return {patch_id: cache_path for patch_id, (cache_path, _, _) in zip(patch_ids, results)}
+
+
+def load_patch_mask(path: str, patch_id: str, cache_dir: str) -> np.ndarray:
+    """Mask of one patch from the cache, rasterized first if it is missing or outdated.
+
+    A hit is a stat of the geoparquet and one np.load, the manifest is read once per process."""
+    manifest = load_manifest(cache_dir)
+    entry = manifest.get(patch_id)
+    if entry is not None and entry[:2] == _manifest_key(_geoparquet_file(path, patch_id)):
+        try:
+            return np.load(mask_cache_path(cache_dir, patch_id, entry[2]))
+        except FileNotFoundError:
+            pass
+
+    cache_path, _, manifest[patch_id] = rasterize_patch_mask(path, patch_id, cache_dir)
+    save_manifest(cache_dir)
+    return np.load(cache_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rasterize the geoparquet label polygons into cached patch masks")
+    parser.add_argument("path", help="directory containing geoparquets/ and BigEarthNet-v2.0-S2-with-errors/")
+    parser.add_argument("cache_dir")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    rasterize_patch_masks(os.path.join(args.path, ""), args.cache_dir, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+####################################
+# Footprint index of the patches  #
+####################################
+
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyproj
+import rasterio
+import shapely
+
+from instrumentation.tracing import instrumented, record_file_read, record_parquet_rows
+
+# All bands of a patch cover the same area, the footprint is taken from the 10 m band header
+FOOTPRINT_BAND = "B02"
+# Query bboxes are densified to this many points per edge before they are reprojected
+BBOX_DENSIFY_POINTS = 16
+
+
+def read_tile_footprints(tile_path: str) -> list:
+    "Footprint of every patch of a tile as (patch_id, tile, crs, wkb), only the band headers are read"
+
+    tile_name = os.path.basename(os.path.normpath(tile_path))
+    rows = []
+    for patch_id in sorted(os.listdir(tile_path)):
+        band_path = os.path.join(tile_path, patch_id, f"{patch_id}_{FOOTPRINT_BAND}.tif")
+        record_file_read(band_path)
+        with rasterio.open(band_path) as band_reader:
+            transform, width, height = band_reader.transform, band_reader.width, band_reader.height
+            crs = band_reader.crs.to_string() if band_reader.crs else None
+
+        # Corners through the transform, so rotated grids get the right footprint as well
+        corners = [transform * corner for corner in [(0, 0), (width, 0), (width, height), (0, height)]]
+        rows.append((patch_id, tile_name, crs, shapely.to_wkb(shapely.Polygon(corners))))
+    return rows
+
+
+@instrumented()
+def build_footprint_index(path: str, index_path: str, workers: int = 4) -> pd.DataFrame:
+    """Read the footprints of all patches of BigEarthNet-v2.0-S2-with-errors/ below path, tiles in parallel,
+    and persist them to index_path. The footprints stay in the CRS of their band, so a parquet file with
+    a crs column is used instead of a GeoParquet file, which only supports one CRS per column."""
+
+    dataset_path = path + "BigEarthNet-v2.0-S2-with-errors/"
+    tile_paths = [dataset_path + tile_name for tile_name in sorted(os.listdir(dataset_path))]
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        rows = [row for tile_rows in executor.map(read_tile_footprints, tile_paths) for row in tile_rows]
+
+    footprints = pd.DataFrame(rows, columns=["patch_id", "tile", "crs", "footprint"])
+    bounds = shapely.bounds(shapely.from_wkb(footprints["footprint"].to_numpy()))
+    footprints[["min_x", "min_y", "max_x", "max_y"]] = bounds
+    footprints.to_parquet(index_path, index=False)
+    print(f"Indexed {len(footprints)} patch footprints in {index_path}")
+    return footprints
+
+
+class FootprintIndex:
+    """In-memory spatial index of the persisted patch footprints, one STRtree per CRS.
+
+    Queries are bulk: all points or bboxes are reprojected to the CRS of every tree and
+    matched in one call, no raster is opened.
+    """
+
+    def __init__(self, index_path: str):
+        record_file_read(index_path)
+        self.footprints = pd.read_parquet(index_path)
+        record_parquet_rows(len(self.footprints))
+
+        geometries = shapely.from_wkb(self.footprints["footprint"].to_numpy())
+        self._trees = {}
+        for crs, positions in self.footprints.groupby("crs", dropna=False).indices.items():
+            self._trees[crs] = (positions, shapely.STRtree(geometries[positions]))
+
+    def __len__(self):
+        return len(self.footprints)
+
+    def _query(self, geometries: np.ndarray, crs: str, predicate: str) -> pd.DataFrame:
+        query_crs = pyproj.CRS.from_user_input(crs)
+        # Seeded with no matches, so an empty index without trees returns an empty frame
+        query_positions, footprint_positions = [np.empty(0, np.int64)], [np.empty(0, np.int64)]
+        for tree_crs, (positions, tree) in self._trees.items():
+            tree_geometries = geometries
+            if not pd.isna(tree_crs) and pyproj.CRS.from_user_input(tree_crs) != query_crs:
+                transformer = pyproj.Transformer.from_crs(query_crs, tree_crs, always_xy=True)
+                tree_geometries = shapely.transform(
+                    geometries, lambda coords: np.column_stack(transformer.transform(coords[:, 0], coords[:, 1])))
+            matches = tree.query(tree_geometries, predicate=predicate)
+            query_positions.append(matches[0])
+            footprint_positions.append(positions[matches[1]])
+
+        query_positions = np.concatenate(query_positions)
+        matched = self.footprints.iloc[np.concatenate(footprint_positions)]
+        result = pd.DataFrame({"query": query_positions, "patch_id": matched["patch_id"].to_numpy(),
+                               "tile": matched["tile"].to_numpy()})
+        return result.sort_values(["query", "patch_id"], ignore_index=True)
+
+    def query_points(self, x, y, crs: str = "EPSG:4326") -> pd.DataFrame:
+        """Patches covering each point, one row per (query, patch_id) match; query is the position of the point.
+        With the default CRS x is the longitude and y the latitude."""
+        return self._query(shapely.points(np.asarray(x, dtype=float), np.asarray(y, dtype=float)), crs, "intersects")
+
+    def query_bboxes(self, min_x, min_y, max_x, max_y, crs: str = "EPSG:4326") -> pd.DataFrame:
+        "Patches intersecting each bbox, one row per (query, patch_id) match; query is the position of the bbox"
+        bboxes = shapely.box(np.asarray(min_x, dtype=float), np.asarray(min_y, dtype=float),
+                             np.asarray(max_x, dtype=float), np.asarray(max_y, dtype=float))
+        # Densified edges stay close to the reprojected bbox, which is curved in another CRS
+        edge_lengths = np.maximum(np.asarray(max_x, dtype=float) - np.asarray(min_x, dtype=float),
+                                  np.asarray(max_y, dtype=float) - np.asarray(min_y, dtype=float))
+        bboxes = shapely.segmentize(bboxes, np.maximum(edge_lengths, 1e-9) / BBOX_DENSIFY_POINTS)
+        return self._query(bboxes, crs, "intersects")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the patch footprints from the band headers")
+    parser.add_argument("path", help="directory containing BigEarthNet-v2.0-S2-with-errors/")
+    parser.add_argument("index_path")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    build_footprint_index(os.path.join(args.path, ""), args.index_path, args.workers)
+
+
+if __name__ == "__main__":
+    main()
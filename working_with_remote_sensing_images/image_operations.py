@@ -6,10 +6,25 @@ import rasterio
 from rasterio.windows import Window
 from rasterio.transform import Affine
 import pandas as pd
+import glob
+import hashlib
 import os
+import json
 import numpy as np
 
-metadata_df = pd.read_parquet('untracked-files/milestone01/metadata.parquet', engine='pyarrow')
+from instrumentation.tracing import instrumented, record_file_read, record_parquet_rows
+
+
+BAND_CODES = ["B01","B02","B03","B04","B05","B06","B07","B08","B8A","B09","B11","B12"]
+
+
+def load_metadata_patch_ids(path: str) -> set:
+    "Load the patch_ids listed in metadata.parquet next to the archive as a set for constant time lookups"
+
+    record_file_read(path + 'metadata.parquet')
+    metadata_df = pd.read_parquet(path + 'metadata.parquet', engine='pyarrow', columns=["patch_id"])
+    record_parquet_rows(len(metadata_df))
+    return set(metadata_df["patch_id"])
 
 
 def band_code_to_valid_size(band_code: str) -> int:
@@ -28,51 +43,137 @@ def band_code_to_valid_size(band_code: str) -> int:
 
     return int(1200 / pixels_per_metre)
 
-def checking_correctness(path: str):
-    "Task 4.1"
+def load_checkpoint(checkpoint_dir: str, shard_name: str):
+    "Return the partial result stored for a shard or None if there is none"
+
+    if checkpoint_dir is None:
+        return None
+    checkpoint_path = os.path.join(checkpoint_dir, shard_name + ".json")
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as checkpoint_file:
+        return json.load(checkpoint_file)
+
+
+def save_checkpoint(checkpoint_dir: str, shard_name: str, checkpoint: dict):
+    "Persist the partial result of a shard, written to a temporary file first so a crash never leaves a truncated checkpoint"
+
+    if checkpoint_dir is None:
+        return
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    checkpoint_path = os.path.join(checkpoint_dir, shard_name + ".json")
+    with open(checkpoint_path + ".tmp", "w") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+
+def clear_checkpoints(checkpoint_dir: str, shard_prefix: str):
+    "Remove the checkpoints of a finished scan, so a later run with the same checkpoint_dir scans everything again"
+
+    if checkpoint_dir is None:
+        return
+    for checkpoint_path in glob.glob(os.path.join(checkpoint_dir, glob.escape(shard_prefix) + "*.json")):
+        os.remove(checkpoint_path)
+
+
+def fingerprint_band_files(dataset_path: str, band_paths: list) -> str:
+    """Hash of the size and modification time of the band files of a shard, part of its shard_key so a
+    checkpoint is only reused while its bands are unchanged"""
+
+    digest = hashlib.sha256()
+    for band_path in band_paths:
+        stat = os.stat(band_path)
+        digest.update(f"{os.path.relpath(band_path, dataset_path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def run_shard(checkpoint_dir: str, shard_name: str, shard_key: dict, compute_shard):
+    """ return the partial result of a shard from its checkpoint if it was computed for the same shard_key,
+    otherwise compute it and checkpoint it together with the shard_key"""
+
+    checkpoint = load_checkpoint(checkpoint_dir, shard_name)
+    if checkpoint is not None and checkpoint["shard_key"] == shard_key:
+        return checkpoint["result"]
+
+    result = compute_shard()
+    save_checkpoint(checkpoint_dir, shard_name, {"shard_key": shard_key, "result": result})
+    return result
+
+
+def check_tile(tile_path: str, patch_ids: list, metadata_patch_ids: set) -> dict:
+    "Count the patches of one tile with wrong sizes, no-data pixels or no metadata entry"
 
     wrong_size = 0
     with_no_data = 0
     not_part_of_dataset = 0
 
+    for patch_id in patch_ids:
+        patch_path = tile_path + patch_id + "/"
+        
+        assert(len(os.listdir(patch_path)) == 12) # patch must have 12 bands, no B10 but B08A
 
-    #/untracked-files/milestone01/BigEarthNet-v2.0-S2-with-errors/
-    dataset_path = path + "BigEarthNet-v2.0-S2-with-errors/"
-
-    for tile_name in os.listdir(dataset_path):
-        tile_path = dataset_path + tile_name + "/"
+        current_patch_wrong_size = 0
+        current_patch_with_no_data = 0
+        current_patch_not_part_of_dataset = 0
 
-        for patch_id in os.listdir(tile_path):
-            patch_path = tile_path + patch_id + "/"
+        if patch_id not in metadata_patch_ids:
+            current_patch_not_part_of_dataset = 1
             
-            assert(len(os.listdir(patch_path)) == 12) # patch must have 12 bands, no B10 but B08A
 
-            current_patch_wrong_size = 0
-            current_patch_with_no_data = 0
-            current_patch_not_part_of_dataset = 0
+        for band_file_name in os.listdir(patch_path):
+            band_path = patch_path + band_file_name
 
-            if patch_id not in metadata_df["patch_id"].values:
-                current_patch_not_part_of_dataset = 1
-                
+            band_code = band_file_name[-7:-4]
+            record_file_read(band_path)
+            with rasterio.open(band_path) as band_reader:
 
-            for band_file_name in os.listdir(patch_path):
-                band_path = patch_path + band_file_name
+                valid_size = band_code_to_valid_size(band_code)
+                if band_reader.width != valid_size or band_reader.height != valid_size:
+                    current_patch_wrong_size = 1
 
-                band_code = band_file_name[-7:-4]
-                with rasterio.open(band_path) as band_reader:
+                if (band_reader.read_masks(1)!=255).any():
+                    current_patch_with_no_data = 1
 
-                    valid_size = band_code_to_valid_size(band_code)
-                    if band_reader.width != valid_size or band_reader.height != valid_size:
-                        current_patch_wrong_size = 1
+        wrong_size += current_patch_wrong_size
+        with_no_data += current_patch_with_no_data
+        not_part_of_dataset += current_patch_not_part_of_dataset
 
-                    if (band_reader.read_masks(1)!=255).any():
-                        current_patch_with_no_data = 1
+    return {"wrong-size": wrong_size, "with-no-data": with_no_data, "not-part-of-dataset": not_part_of_dataset}
+
+
+@instrumented()
+def checking_correctness(path: str, checkpoint_dir: str = None):
+    """Task 4.1, each tile is one shard: with a checkpoint_dir the counters of every finished tile
+    are persisted and a restarted run only checks the tiles that are not done yet. A tile is checked
+    again when one of its band files changed, the checkpoints are removed once all tiles are done"""
+
+    wrong_size = 0
+    with_no_data = 0
+    not_part_of_dataset = 0
+
+    metadata_patch_ids = load_metadata_patch_ids(path)
+
+    #/untracked-files/milestone01/BigEarthNet-v2.0-S2-with-errors/
+    dataset_path = path + "BigEarthNet-v2.0-S2-with-errors/"
+
+    for tile_name in sorted(os.listdir(dataset_path)):
+        tile_path = dataset_path + tile_name + "/"
+        patch_ids = sorted(os.listdir(tile_path))
+
+        shard_key = {"patch_ids": patch_ids}
+        if checkpoint_dir is not None:
+            band_paths = [tile_path + patch_id + "/" + band_file_name for patch_id in patch_ids
+                          for band_file_name in sorted(os.listdir(tile_path + patch_id))]
+            shard_key["band_files"] = fingerprint_band_files(dataset_path, band_paths)
+        tile_counts = run_shard(checkpoint_dir, "correctness_" + tile_name, shard_key,
+                                lambda: check_tile(tile_path, patch_ids, metadata_patch_ids))
+
+        wrong_size += tile_counts["wrong-size"]
+        with_no_data += tile_counts["with-no-data"]
+        not_part_of_dataset += tile_counts["not-part-of-dataset"]
+
+    clear_checkpoints(checkpoint_dir, "correctness_")
 
-            wrong_size += current_patch_wrong_size
-            with_no_data += current_patch_with_no_data
-            not_part_of_dataset += current_patch_not_part_of_dataset
-            
-            
     print("\nwrong-size: ", wrong_size, 
           "\nwith-no-data: ", with_no_data, 
           "\nnot-part-of-dataset: ", not_part_of_dataset)
@@ -86,7 +187,9 @@ def count_and_sum(row, path, band_code):
     pixel_count = 0
     pixel_sum = 0
 
-    with rasterio.open(path + row["tile"] + "/" + row["patch_id"] + "/" + row["patch_id"] + "_" + band_code + ".tif" ) as band_reader:
+    band_path = path + row["tile"] + "/" + row["patch_id"] + "/" + row["patch_id"] + "_" + band_code + ".tif"
+    record_file_read(band_path)
+    with rasterio.open(band_path) as band_reader:
         
         pixel_count = (band_reader.read_masks(1)==255).sum()
         pixel_sum = band_reader.read(1, masked = True).sum()
@@ -100,39 +203,93 @@ def count_and_sumSqDev(row, path, band_code, average):
 
     squaredDeviation = 0
 
-    with rasterio.open(path + row["tile"] + "/" + row["patch_id"] + "/" + row["patch_id"] + "_" + band_code + ".tif" ) as band_reader:
+    band_path = path + row["tile"] + "/" + row["patch_id"] + "/" + row["patch_id"] + "_" + band_code + ".tif"
+    record_file_read(band_path)
+    with rasterio.open(band_path) as band_reader:
 
         squaredDeviation = ((band_reader.read(1, masked = True)-average)**2).sum()
 
     return squaredDeviation
 
 
-def calculating_image_statistics(path: str):
-    "Task 4.2"
+def sum_shard(shard_df, dataset_path: str) -> dict:
+    "per band and patch of a shard the count and sum of non-NO_DATA pixels"
+
+    result = {}
+    for band_code in BAND_CODES:
+        counts_and_sums = shard_df.apply(count_and_sum, axis=1, result_type="expand", args=(dataset_path, band_code))
+        result[band_code] = {"count": [int(value) for value in counts_and_sums[0]],
+                             "sum": [int(value) for value in counts_and_sums[1]]}
+    return result
+
+
+def sumSqDev_shard(shard_df, dataset_path: str, means: dict) -> dict:
+    "per band and patch of a shard the sum of squared deviations to the band mean"
+
+    return {band_code: [float(value) for value in
+                        shard_df.apply(count_and_sumSqDev, axis=1, result_type="expand", args=(dataset_path, band_code, means[band_code]))]
+            for band_code in BAND_CODES}
+
+
+@instrumented()
+def calculating_image_statistics(path: str, checkpoint_dir: str = None, shard_size: int = 1000):
+    """Task 4.2, patches are processed in shards of shard_size rows: with a checkpoint_dir the per-patch
+    partial sums of every finished shard are persisted and a restarted run only processes the missing shards.
+    Shards with changed band files are processed again and the checkpoints are removed at the end.
+    The per-patch values are reduced in the original order, so the result equals an uninterrupted run"""
+    record_file_read(path+'patches_for_stats.csv.gz')
     patches_for_stats_df = pd.read_csv(path+'patches_for_stats.csv.gz',compression="gzip")#.head() 
     
     dataset_path = path + "BigEarthNet-v2.0-S2-with-errors/"
 
-    for band_code in ["B01","B02","B03","B04","B05","B06","B07","B08","B8A","B09","B11","B12"]:
-        
-        counts_and_sums = patches_for_stats_df.apply(count_and_sum, axis=1, result_type="expand", args=(dataset_path, band_code))
+    shards = [patches_for_stats_df.iloc[start:start + shard_size] for start in range(0, len(patches_for_stats_df), shard_size)]
+
+    shard_keys = [{"patch_ids": shard_df["patch_id"].tolist()} for shard_df in shards]
+    if checkpoint_dir is not None:
+        for shard_key, shard_df in zip(shard_keys, shards):
+            shard_key["band_files"] = fingerprint_band_files(dataset_path, [
+                dataset_path + tile + "/" + patch_id + "/" + patch_id + "_" + band_code + ".tif"
+                for tile, patch_id in zip(shard_df["tile"], shard_df["patch_id"]) for band_code in BAND_CODES])
 
+    # first pass: pixel counts and sums for the means
+    sums = [run_shard(checkpoint_dir, f"stats_sums_{index}", shard_key,
+                      lambda: sum_shard(shard_df, dataset_path))
+            for index, (shard_key, shard_df) in enumerate(zip(shard_keys, shards))]
 
-        pixel_count, pixel_sum = counts_and_sums[0].sum(), counts_and_sums[1].sum()
+    pixel_counts, means = {}, {}
+    for band_code in BAND_CODES:
+        pixel_count = pd.Series([count for shard in sums for count in shard[band_code]["count"]], dtype=np.int64).sum()
+        pixel_sum = pd.Series([value for shard in sums for value in shard[band_code]["sum"]], dtype=np.uint64).sum()
         
-        mean = pixel_sum / pixel_count
+        pixel_counts[band_code] = pixel_count
+        means[band_code] = pixel_sum / pixel_count
+
+    # second pass: squared deviations to the means for the standard deviations
+    json_means = {band_code: float(mean) for band_code, mean in means.items()}
+    squared_deviations = [run_shard(checkpoint_dir, f"stats_sqdev_{index}", dict(shard_key, means=json_means),
+                                    lambda: sumSqDev_shard(shard_df, dataset_path, means))
+                          for index, (shard_key, shard_df) in enumerate(zip(shard_keys, shards))]
+    clear_checkpoints(checkpoint_dir, "stats_")
+
+    statistics = {}
+    for band_code in BAND_CODES:
+        mean = means[band_code]
 
         std_dev = np.sqrt(
-            patches_for_stats_df.apply(count_and_sumSqDev, axis=1, result_type="expand", args=(dataset_path, band_code, mean))
+            pd.Series([value for shard in squared_deviations for value in shard[band_code]], dtype=np.float64)
                 .sum() / 
-                (pixel_count - 1)
+                (pixel_counts[band_code] - 1)
         )
         
 
         print(band_code, "mean:", round(mean))
         print(band_code, "std-dev:", round(std_dev))
+        statistics[band_code] = (mean, std_dev)
+
+    return statistics
 
 
+@instrumented()
 def retiling_images(path: str):
     "Task 4.3 split patch into 4 subpatches while preserving and adapting relevant georeferencing data to subwindows"
 
@@ -143,6 +300,7 @@ def retiling_images(path: str):
     write_path_suffixless = "untracked-files/re-tiled/S2B_MSIL2A_20170808T094029_N9999_R036_T35ULA_33_29_B02"
     suffixes = ["_A.tif", "_B.tif", "_C.tif", "_D.tif"]
 
+    record_file_read(image_path)
     with rasterio.open(image_path) as band_reader:
 
         assert(band_reader.width % 2 == 0 and band_reader.height % 2 == 0) # task specifies "re-tile it into four equally sized"
@@ -0,0 +1,260 @@
+######################################
+# Repacking the archive per S2 tile #
+######################################
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.transform import Affine
+
+from instrumentation.tracing import instrumented, record_file_read, record_parquet_rows
+from working_with_remote_sensing_images.image_operations import BAND_CODES, band_code_to_valid_size, load_metadata_patch_ids
+
+# GeoTIFF stores the number of planes of a directory as 16 bit integer
+MAX_PLANES_PER_DIRECTORY = 65535
+
+
+# Dataset tag of every repacked GeoTIFF, as the georeferencing GDAL reports is only valid for plane 1
+GEOREFERENCING_NOTE = ("The transform of this directory is the one of plane 1. Every plane has its own transform in "
+                       "its TRANSFORM band tag and in <tile>.index.parquet, which RepackedArchive reads.")
+
+
+def read_tile_planes(tile_path: str) -> pd.DataFrame:
+    "Read the header of every band GeoTIFF of a tile, one row per (patch_id, band) with its path and georeferencing"
+
+    rows = []
+    for patch_id in sorted(os.listdir(tile_path)):
+        patch_path = os.path.join(tile_path, patch_id)
+        for band_file_name in sorted(os.listdir(patch_path)):
+            band_path = os.path.join(patch_path, band_file_name)
+            record_file_read(band_path)
+            with rasterio.open(band_path) as band_reader:
+                rows.append({
+                    "patch_id": patch_id,
+                    "band": band_file_name[-7:-4],
+                    "height": band_reader.height,
+                    "width": band_reader.width,
+                    "dtype": band_reader.dtypes[0],
+                    "nodata": band_reader.nodata,
+                    "crs": band_reader.crs.to_string() if band_reader.crs else None,
+                    "transform": tuple(band_reader.transform)[:6],
+                    "path": band_path,
+                })
+    return pd.DataFrame(rows)
+
+
+def repack_tile(tile_path: str, output_path: str) -> str:
+    """Losslessly merge all band GeoTIFFs of one tile into <output_path>/<tile>.tif.
+
+    Planes of equal size, dtype, no-data value and CRS (in practice one group per
+    native resolution) are stacked into one directory of the GeoTIFF. Every plane
+    is a single compressed strip, so one (patch_id, band) is one chunk read. The
+    bands are copied plane by plane, so only one band is held in memory at a time.
+    The per-plane georeferencing goes to <tile>.index.parquet and to the TRANSFORM
+    tag of every plane; the transform of a directory itself is the one of its
+    first plane.
+    """
+    tile_name = os.path.basename(os.path.normpath(tile_path))
+    store_name = tile_name + ".tif"
+    store_path = os.path.join(output_path, store_name)
+    planes = read_tile_planes(tile_path)
+
+    group_keys = ["height", "width", "dtype", "nodata", "crs"]
+    # groupby drops missing keys, so a missing no-data value or CRS is grouped as a string
+    groups = planes[group_keys].astype(str).groupby(group_keys, sort=False).ngroup()
+    planes["directory"] = groups + 1
+    planes["plane"] = planes.groupby(groups).cumcount() + 1
+
+    if os.path.exists(store_path):
+        os.remove(store_path)
+    for directory, group in planes.groupby("directory", sort=True):
+        assert len(group) <= MAX_PLANES_PER_DIRECTORY, f"Too many planes in {tile_name}: {len(group)}"
+        first = group.iloc[0]
+        profile = {"driver": "GTiff", "count": len(group), "height": int(first["height"]), "width": int(first["width"]),
+                   "dtype": first["dtype"], "crs": first["crs"], "transform": Affine(*first["transform"]),
+                   "compress": "DEFLATE", "predictor": 2, "interleave": "band", "blockysize": int(first["height"])}
+        if first["nodata"] is not None and not np.isnan(first["nodata"]):
+            profile["nodata"] = first["nodata"]
+        if directory > 1:
+            profile["APPEND_SUBDATASET"] = "YES"
+
+        with rasterio.open(store_path, "w", **profile) as store_writer:
+            store_writer.update_tags(GEOREFERENCING=GEOREFERENCING_NOTE)
+            for row in group.itertuples():
+                with rasterio.open(row.path) as band_reader:
+                    store_writer.write(band_reader.read(1), int(row.plane))
+                store_writer.set_band_description(int(row.plane), f"{row.patch_id}_{row.band}")
+                store_writer.update_tags(int(row.plane), TRANSFORM=json.dumps(row.transform))
+
+    index = planes.drop(columns=["path", "transform"])
+    index[["a", "b", "c", "d", "e", "f"]] = pd.DataFrame(planes["transform"].to_list(), index=planes.index)
+    index["tile"] = tile_name
+    index["file"] = store_name
+    index.to_parquet(os.path.join(output_path, tile_name + ".index.parquet"), index=False)
+    return store_path
+
+
+@instrumented()
+def repack_archive(path: str, output_path: str, workers: int = 4):
+    "Repack every tile of BigEarthNet-v2.0-S2-with-errors/ below path into output_path, tiles in parallel"
+
+    dataset_path = path + "BigEarthNet-v2.0-S2-with-errors/"
+    os.makedirs(output_path, exist_ok=True)
+    tile_paths = [dataset_path + tile_name for tile_name in sorted(os.listdir(dataset_path))]
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        store_paths = list(executor.map(repack_tile, tile_paths, [output_path] * len(tile_paths)))
+    print(f"Repacked {len(store_paths)} tiles into {output_path}")
+    return store_paths
+
+
+class RepackedArchive:
+    """Reader of a repacked archive, returns the (patch_id, band) arrays with a single chunk read.
+
+    Open datasets are kept per GeoTIFF directory, so repeated reads do not reopen files.
+    """
+
+    def __init__(self, repacked_path: str):
+        self.path = repacked_path
+        index_files = sorted(glob.glob(os.path.join(repacked_path, "*.index.parquet")))
+        assert index_files, f"No repacked tiles in {repacked_path}"
+        for index_file in index_files:
+            record_file_read(index_file)
+        self.index = pd.concat([pd.read_parquet(index_file) for index_file in index_files], ignore_index=True)
+        record_parquet_rows(len(self.index))
+
+        self._rows = dict(zip(zip(self.index["patch_id"], self.index["band"]), range(len(self.index))))
+        self._datasets = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for dataset in self._datasets.values():
+            dataset.close()
+        self._datasets = {}
+
+    def _row(self, patch_id: str, band: str):
+        return self.index.iloc[self._rows[(patch_id, band)]]
+
+    def dataset(self, file: str, directory: int):
+        key = (file, int(directory))
+        if key not in self._datasets:
+            store_path = os.path.join(self.path, file)
+            record_file_read(store_path)
+            self._datasets[key] = rasterio.open(f"GTIFF_DIR:{int(directory)}:{store_path}")
+        return self._datasets[key]
+
+    def profile(self, patch_id: str, band: str) -> dict:
+        "Georeferencing of one band of a patch, as it was in the original GeoTIFF"
+        row = self._row(patch_id, band)
+        return {
+            "width": int(row["width"]),
+            "height": int(row["height"]),
+            "dtype": row["dtype"],
+            "nodata": row["nodata"],
+            "crs": row["crs"],
+            "transform": Affine(*row[["a", "b", "c", "d", "e", "f"]].astype(float)),
+        }
+
+    def read(self, patch_id: str, band: str, masked: bool = False) -> np.ndarray:
+        row = self._row(patch_id, band)
+        return self.dataset(row["file"], row["directory"]).read(int(row["plane"]), masked=masked)
+
+
+@instrumented()
+def checking_correctness_repacked(path: str, repacked_path: str):
+    "Task 4.1 on a repacked archive, prints the same counters as checking_correctness"
+
+    metadata_patch_ids = load_metadata_patch_ids(path)
+
+    with RepackedArchive(repacked_path) as archive:
+        index = archive.index
+        assert (index.groupby("patch_id").size() == len(BAND_CODES)).all() # patch must have 12 bands, no B10 but B08A
+
+        valid_sizes = index["band"].map(band_code_to_valid_size)
+        index_wrong_size = (index["width"] != valid_sizes) | (index["height"] != valid_sizes)
+
+        # The masks are read one plane at a time, so memory does not grow with the planes of a directory
+        index_no_data = pd.Series(False, index=index.index)
+        for (file, directory), group in index.groupby(["file", "directory"]):
+            dataset = archive.dataset(file, directory)
+            index_no_data[group.index] = [(dataset.read_masks(int(plane)) != 255).any() for plane in group["plane"]]
+
+        patches = pd.DataFrame({"patch_id": index["patch_id"], "wrong_size": index_wrong_size,
+                                "no_data": index_no_data}).groupby("patch_id").any()
+
+    wrong_size = int(patches["wrong_size"].sum())
+    with_no_data = int(patches["no_data"].sum())
+    not_part_of_dataset = int((~patches.index.isin(metadata_patch_ids)).sum())
+
+    print("\nwrong-size: ", wrong_size,
+          "\nwith-no-data: ", with_no_data,
+          "\nnot-part-of-dataset: ", not_part_of_dataset)
+
+
+def count_and_sum_repacked(archive: RepackedArchive, patch_id: str, band_code: str) -> tuple:
+    "count_and_sum on a repacked archive: count and sum of the non-NO_DATA pixels of one band of a patch"
+    band = archive.read(patch_id, band_code, masked=True)
+    return int((~np.ma.getmaskarray(band)).sum()), int(band.sum())
+
+
+def count_and_sumSqDev_repacked(archive: RepackedArchive, patch_id: str, band_code: str, average: float) -> float:
+    "count_and_sumSqDev on a repacked archive: sum of squared deviations to the band mean of one band of a patch"
+    return float(((archive.read(patch_id, band_code, masked=True) - average)**2).sum())
+
+
+@instrumented()
+def calculating_image_statistics_repacked(path: str, repacked_path: str):
+    """Task 4.2 on a repacked archive. Every band is read twice and only the per-patch scalars are kept,
+    they are reduced like in calculating_image_statistics, so the results are identical"""
+
+    record_file_read(path+'patches_for_stats.csv.gz')
+    patches_for_stats_df = pd.read_csv(path+'patches_for_stats.csv.gz',compression="gzip")
+    patch_ids = patches_for_stats_df["patch_id"].tolist()
+
+    statistics = {}
+    with RepackedArchive(repacked_path) as archive:
+        for band_code in BAND_CODES:
+            # first pass: pixel counts and sums for the mean
+            counts_and_sums = [count_and_sum_repacked(archive, patch_id, band_code) for patch_id in patch_ids]
+            pixel_count = pd.Series([count for count, _ in counts_and_sums], dtype=np.int64).sum()
+            pixel_sum = pd.Series([value for _, value in counts_and_sums], dtype=np.uint64).sum()
+            mean = pixel_sum / pixel_count
+
+            # second pass: squared deviations to the mean for the standard deviation
+            std_dev = np.sqrt(
+                pd.Series([count_and_sumSqDev_repacked(archive, patch_id, band_code, mean) for patch_id in patch_ids],
+                          dtype=np.float64).sum() /
+                (pixel_count - 1)
+            )
+
+            print(band_code, "mean:", round(mean))
+            print(band_code, "std-dev:", round(std_dev))
+            statistics[band_code] = (mean, std_dev)
+
+    return statistics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Repack the per-band GeoTIFFs into one store per tile")
+    parser.add_argument("path", help="directory containing BigEarthNet-v2.0-S2-with-errors/")
+    parser.add_argument("output_path")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    repack_archive(os.path.join(args.path, ""), args.output_path, args.workers)
+
+
+if __name__ == "__main__":
+    main()
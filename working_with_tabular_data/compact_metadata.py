@@ -0,0 +1,124 @@
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from instrumentation.tracing import record_file_read, record_parquet_rows
+
+# Fixed code order, so the integer codes mean the same in every table
+SEASONS = ("spring", "summer", "autumn", "winter")
+SPLITS = ("train", "validation", "test")
+# Season code of every month, index 0 is unused
+MONTH_TO_SEASON = np.array([-1, 3, 3, 0, 0, 0, 1, 1, 1, 2, 2, 2, 3], dtype=np.int8)
+
+# patch_id is unique per row, dictionary encoding it would only add the indices
+UNIQUE_STRING_COLUMNS = ("patch_id", "s1_name")
+
+
+def _is_string(data_type: pa.DataType) -> bool:
+    return pa.types.is_string(data_type) or pa.types.is_large_string(data_type)
+
+
+def _index_type(num_values: int) -> pa.DataType:
+    for index_type in (pa.int8(), pa.int16(), pa.int32()):
+        if num_values <= np.iinfo(index_type.to_pandas_dtype()).max + 1:
+            return index_type
+    return pa.int64()
+
+
+def encode_strings(values, categories=None) -> pa.DictionaryArray:
+    """Dictionary encode a string array with the smallest index type that fits.
+
+    Without categories the dictionary is the sorted distinct values, so codes order
+    like the strings. Values missing from given categories become null.
+    """
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    if isinstance(values, pa.DictionaryArray):
+        values = values.dictionary_decode()
+    values = values.cast(pa.string())
+    if categories is None:
+        categories = pc.drop_null(pc.unique(values)).sort()
+    categories = pa.array(categories, type=pa.string())
+
+    indices = pc.index_in(values, value_set=categories)
+    return pa.DictionaryArray.from_arrays(indices.cast(_index_type(len(categories))), categories)
+
+
+def encode_labels(labels) -> pa.ListArray:
+    "list<string> labels as list<dictionary>: a flat int8 label-id array plus the list offsets"
+    if isinstance(labels, pa.ChunkedArray):
+        labels = labels.combine_chunks()
+    offsets = pc.subtract(labels.offsets, labels.offsets[0])
+    return pa.ListArray.from_arrays(offsets, encode_strings(labels.flatten()), mask=labels.is_null())
+
+
+def label_ids_and_offsets(labels) -> tuple:
+    """Zero-copy numpy views of compact labels: label ids of all patches back to back, the offsets
+    where the labels of every patch start (one more than rows) and the label names of the ids"""
+    if isinstance(labels, pa.ChunkedArray):
+        labels = labels.combine_chunks()
+    # Offsets of a sliced array do not start at 0, the values are sliced accordingly
+    offsets = labels.offsets.to_numpy()
+    values = labels.values.slice(offsets[0], offsets[-1] - offsets[0])
+    return values.indices.to_numpy(zero_copy_only=False), offsets - offsets[0], values.dictionary
+
+
+def season_codes(patch_ids) -> np.ndarray:
+    "Vectorized determine_season_from_patch_id, returns the int8 code of the season in SEASONS"
+    if isinstance(patch_ids, pa.ChunkedArray):
+        patch_ids = patch_ids.combine_chunks()
+    date_times = pc.list_element(pc.split_pattern(patch_ids, "_", max_splits=3), 2)
+    dates = pc.list_element(pc.split_pattern(date_times, "T", max_splits=1), 0)
+
+    invalid = pc.not_equal(pc.utf8_length(dates), 8)
+    assert not pc.any(invalid).as_py(), f"Datetime is not in the correct format: {
+        dates.filter(invalid)[0]}, expected YYYYMMDD corresponding to 8 characters"
+    months = pc.cast(pc.utf8_slice_codeunits(dates, 4, 6), pa.int8()).to_numpy()
+    invalid = (months < 1) | (months > 12)
+    assert not invalid.any(), f"Month is out of range: {months[invalid][0]}"
+
+    return MONTH_TO_SEASON[months]
+
+
+def encode_codes(codes: np.ndarray, categories) -> pa.DictionaryArray:
+    "int8 codes into the given categories, e.g. SEASONS or SPLITS, as dictionary array"
+    return pa.DictionaryArray.from_arrays(pa.array(codes, type=pa.int8()), pa.array(categories, type=pa.string()))
+
+
+def compact_metadata(metadata: pa.Table) -> pa.Table:
+    "Encode labels and every repeated string column of a metadata table, split with the fixed SPLITS codes"
+    for index, field in enumerate(metadata.schema):
+        column = metadata.column(index)
+        if field.name == "split":
+            column = encode_strings(column, SPLITS)
+        elif pa.types.is_list(field.type) and _is_string(field.type.value_type):
+            column = encode_labels(column)
+        elif _is_string(field.type) and field.name not in UNIQUE_STRING_COLUMNS:
+            column = encode_strings(column)
+        else:
+            continue
+        metadata = metadata.set_column(index, field.name, column)
+    return metadata
+
+
+def load_compact_metadata(path: str, columns: list = None) -> pa.Table:
+    """Arrow counterpart of load_metadata: strings stay in Arrow buffers instead of Python objects,
+    repeated strings and labels are dictionary encoded. Only the given columns are read."""
+    full_path = os.path.abspath(path)
+    assert os.path.exists(full_path), f"File does not exist: {full_path}"
+    record_file_read(full_path)
+    metadata = pq.read_table(full_path, columns=columns)
+    record_parquet_rows(metadata.num_rows)
+    # large_string offsets take 8 bytes per row, metadata strings never need them
+    if "patch_id" in metadata.column_names and pa.types.is_large_string(metadata.schema.field("patch_id").type):
+        metadata = metadata.set_column(metadata.column_names.index("patch_id"), "patch_id",
+                                       metadata["patch_id"].cast(pa.string()))
+    return compact_metadata(metadata)
+
+
+def add_season_column(metadata: pa.Table) -> pa.Table:
+    "Compact counterpart of add_season_column_to_metadata, season as int8 codes into SEASONS"
+    return metadata.append_column("season", encode_codes(season_codes(metadata["patch_id"]), SEASONS))
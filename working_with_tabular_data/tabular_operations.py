@@ -1,5 +1,13 @@
 import duckdb
 import os
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from instrumentation.tracing import instrumented, record_file_read, record_parquet_rows, duckdb_query
+from working_with_tabular_data.compact_metadata import SEASONS, add_season_column, label_ids_and_offsets, load_compact_metadata
+
+BACKENDS = ("pandas", "polars", "arrow")
 
 
 def determine_season_from_patch_id(patch_id: str):
@@ -32,10 +40,21 @@ def load_metadata(path: str):
     # Check if file exists
     assert os.path.exists(full_path), f"File does not exist: {full_path}"
     # Load metadata from parquet file
-    metadata = duckdb.sql(f"SELECT * FROM '{full_path}'").df()
+    record_file_read(full_path)
+    with duckdb_query():
+        metadata = duckdb.sql(f"SELECT * FROM '{full_path}'").df()
+    record_parquet_rows(len(metadata))
     return metadata
 
 
+def scan_metadata(path: str) -> pl.LazyFrame:
+    # Lazy polars counterpart of load_metadata, columns and rows are only read when collected
+    full_path = os.path.abspath(path)
+    assert os.path.exists(full_path), f"File does not exist: {full_path}"
+    record_file_read(full_path)
+    return pl.scan_parquet(full_path)
+
+
 def add_season_column_to_metadata(metadata):
     metadata['season'] = metadata['patch_id'].apply(
         determine_season_from_patch_id)
@@ -51,30 +70,88 @@ def count_rows_per_season(metadata):
     return spring_count, summer_count, autumn_count, winter_count
 
 
-def get_label_statistics(metadata_path: str):
-    """Load metadata and return a tuple of (label_counts, metadata) for reuse"""
+def count_rows_per_season_polars(metadata_path: str):
+    """Polars counterpart of add_season_column_to_metadata and count_rows_per_season.
+
+    Only the patch_id column is scanned and all counts are computed in a single query.
+    """
+    date = pl.col("patch_id").str.split("_").list.get(
+        2, null_on_oob=True).str.split("T").list.first()
+    month = date.str.slice(4, 2).cast(pl.Int32, strict=False)
+
+    counts = scan_metadata(metadata_path).select(
+        num_rows=pl.len(),
+        invalid_dates=(date.str.len_chars() != 8).fill_null(True).sum(),
+        invalid_months=(~month.is_between(1, 12)).fill_null(True).sum(),
+        spring=month.is_in([3, 4, 5]).sum(),
+        summer=month.is_in([6, 7, 8]).sum(),
+        autumn=month.is_in([9, 10, 11]).sum(),
+        winter=month.is_in([12, 1, 2]).sum(),
+    ).collect().row(0, named=True)
+    record_parquet_rows(counts["num_rows"])
+
+    assert counts["invalid_dates"] == 0, "Datetime is not in the correct format, expected YYYYMMDD corresponding to 8 characters"
+    assert counts["invalid_months"] == 0, "Month is out of range"
+    return counts["spring"], counts["summer"], counts["autumn"], counts["winter"]
+
+
+def count_rows_per_season_compact(metadata):
+    """count_rows_per_season on compact metadata with a season column from add_season_column,
+    a single bincount over the int8 season codes"""
+    season = metadata["season"].combine_chunks()
+    counts = np.bincount(season.indices.to_numpy(), minlength=len(SEASONS))
+    counts = dict(zip(season.dictionary.to_pylist(), counts))
+    return counts["spring"], counts["summer"], counts["autumn"], counts["winter"]
+
+
+def get_label_statistics(metadata_path: str, backend: str = "pandas"):
+    """Load metadata and return the number of labels of every patch"""
+    assert backend in BACKENDS, f"Unknown backend: {backend}, expected one of {BACKENDS}"
+    if backend == "polars":
+        label_counts = scan_metadata(metadata_path).select(
+            pl.col("labels").list.len()).collect()["labels"]
+        record_parquet_rows(len(label_counts))
+        return label_counts
+    if backend == "arrow":
+        # The label counts are the differences of the list offsets, no label is touched
+        metadata = load_compact_metadata(metadata_path, columns=["labels"])
+        _, offsets, _ = label_ids_and_offsets(metadata["labels"])
+        return pd.Series(np.diff(offsets).astype(np.int64), name="labels")
+
     metadata = load_metadata(metadata_path)
     labels = metadata["labels"]
     label_counts = labels.apply(len)
     return label_counts
 
 
-def print_counts_per_season(metadata_path: str):
-    metadata = load_metadata(metadata_path)
-    metadata = add_season_column_to_metadata(metadata)
-    spring_count, summer_count, autumn_count, winter_count = count_rows_per_season(
-        metadata)
+@instrumented()
+def print_counts_per_season(metadata_path: str, backend: str = "pandas"):
+    assert backend in BACKENDS, f"Unknown backend: {backend}, expected one of {BACKENDS}"
+    if backend == "polars":
+        spring_count, summer_count, autumn_count, winter_count = count_rows_per_season_polars(
+            metadata_path)
+    elif backend == "arrow":
+        metadata = add_season_column(load_compact_metadata(metadata_path, columns=["patch_id"]))
+        spring_count, summer_count, autumn_count, winter_count = count_rows_per_season_compact(
+            metadata)
+    else:
+        metadata = load_metadata(metadata_path)
+        metadata = add_season_column_to_metadata(metadata)
+        spring_count, summer_count, autumn_count, winter_count = count_rows_per_season(
+            metadata)
     print(f"spring: {spring_count}\nsummer: {summer_count}\nautumn: {
           autumn_count}\nwinter: {winter_count}")
 
 
-def print_avg_num_labels(metadata_path: str):
-    label_counts = get_label_statistics(metadata_path)
+@instrumented()
+def print_avg_num_labels(metadata_path: str, backend: str = "pandas"):
+    label_counts = get_label_statistics(metadata_path, backend)
     avg_num_labels = label_counts.mean()  # More efficient than sum/len
     print(
         f"average-num-labels: {round(avg_num_labels, 2)}")
 
 
-def print_max_num_labels(metadata_path: str):
-    label_counts = get_label_statistics(metadata_path)
+@instrumented()
+def print_max_num_labels(metadata_path: str, backend: str = "pandas"):
+    label_counts = get_label_statistics(metadata_path, backend)
     print(f"maximum-num-labels: {label_counts.max()}")